@@ -4,17 +4,27 @@ import io
 import re
 import json
 import base64
+import csv
 import hashlib
 import secrets
-from datetime import datetime
+import sqlite3
+from datetime import datetime, timedelta
 from pathlib import Path
 from typing import List, Dict, Any
 
 import streamlit as st
-import mammoth
-from bs4 import BeautifulSoup
 import pandas as pd
 
+from playbook_parser import file_digest
+from playbook_search import SEARCH_AVAILABLE, SearchIndex, timed_search
+from audit_log import AuditIndex, audit, dropped_count, start_audit_logging
+from auth import AuthBusy, LoginThrottle, UserDirectory, hash_password, verify_password
+from progress_store import (ProgressCache, ProgressStore, ProgressWriter, TaskIndex, TaskProgress,
+                            is_action_table, stable_key)
+from playbook_registry import PlaybookPrewarmer, PlaybookRegistry
+from task_migration import plan_moves
+from perf_spans import recorder as span_recorder, samples_jsonl, span, start_span_export
+
 try:
     import openpyxl
     OPENPYXL_AVAILABLE = True
@@ -24,15 +34,39 @@ except ImportError:
 import logging
 
 # === CONFIGURATION ===
-ref_pattern = re.compile(r'^\d+(\.\d+)*\b')
+# Operational messages (migrations, pre-warm, parse timings); the audit trail is separate.
 logging.basicConfig(
-    filename='audit.log',
+    filename='app.log',
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
+# User actions go to the structured audit trail (audit.jsonl), written off the request thread.
+start_audit_logging()
+# Optional Prometheus/JSON-lines export of the hot-path timing spans (see perf_spans).
+start_span_export()
 
 PLAYBOOKS_DIR = "playbooks"
 USERS_FILE = "users.json"
+PROGRESS_DB = os.path.join(PLAYBOOKS_DIR, "progress.db")
+# "user": expander state is a per-user UI preference; "shared": stored with playbook progress.
+EXPANDER_STATE_SCOPE = os.environ.get("EXPANDER_STATE_SCOPE", "user")
+# Memory budget for the process-wide parsed playbook registry.
+PLAYBOOK_REGISTRY_MB = int(os.environ.get("PLAYBOOK_REGISTRY_MB", "256"))
+# Parse every playbook in worker processes when the server starts.
+PREWARM_PLAYBOOKS = os.environ.get("PREWARM_PLAYBOOKS", "1") == "1"
+PREWARM_WORKERS = int(os.environ.get("PREWARM_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+# Build widgets only for expanded sections; collapsed ones show a header and progress summary.
+LAZY_SECTIONS = os.environ.get("LAZY_SECTIONS", "1") == "1"
+# A toggle that moves the whole-number percentage reruns the page itself; this optionally also polls
+# for other sessions' writes every N seconds, at one server round-trip per open session each time.
+PROGRESS_REFRESH_SECONDS = float(os.environ.get("PROGRESS_REFRESH_SECONDS", "0")) or None
+# How often the user directory stat()s users.json for edits made outside the app.
+USERS_CHECK_SECONDS = float(os.environ.get("USERS_CHECK_SECONDS", "1"))
+# Reverse proxies in front of the app that append to X-Forwarded-For. 0 trusts no header and
+# throttles logins by the connection's own address.
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", "0"))
+# Formats browsers can display and Streamlit serves with an image Content-Type.
+WEB_IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".webp")
 Path(PLAYBOOKS_DIR).mkdir(exist_ok=True)
 Path(USERS_FILE).touch(exist_ok=True)
 
@@ -156,15 +190,14 @@ button[kind="secondary"] {{
 """, unsafe_allow_html=True)
 
 # === USER MANAGEMENT ===
+@st.cache_resource
+def get_user_directory() -> UserDirectory:
+    return UserDirectory(USERS_FILE, USERS_CHECK_SECONDS)
+
 def load_users():
-    if os.path.exists(USERS_FILE):
-        try:
-            with open(USERS_FILE, "r") as f:
-                content = f.read().strip()
-                if content:
-                    return {k.lower(): v for k, v in json.loads(content).items()}
-        except (json.JSONDecodeError, ValueError):
-            pass
+    users = get_user_directory().snapshot()
+    if users:
+        return users
 
     admin_email = "admin@joval.com"
     admin_hash = st.secrets.get("ADMIN_PASSWORD_HASH")
@@ -177,33 +210,41 @@ def load_users():
     return default_admin
 
 def save_users(users):
-    with open(USERS_FILE, "w") as f:
-        json.dump({k.lower(): v for k, v in users.items()}, f, indent=2)
+    get_user_directory().save(users)
 
 def get_user_role(email):
-    users = load_users()
-    return users.get(email.lower(), {}).get("role", "user")
+    return get_user_directory().role(email)
+
+SERVER_BUSY = "The server is busy. Please try again in a moment."
 
 def create_user(email, role, password):
-    users = load_users()
     email = email.lower()
+    if email in load_users():
+        return False, "User already exists."
+    try:
+        password_hash = hash_password(password)
+    except (AuthBusy, TimeoutError):
+        return False, SERVER_BUSY
+    # Re-read after the slow hash so changes made meanwhile are kept.
+    users = load_users()
     if email in users:
         return False, "User already exists."
-    hash_pass = hashlib.sha256(password.encode()).hexdigest()
-    users[email] = {"role": role, "hash": hash_pass}
+    users[email] = {"role": role, "hash": password_hash}
     save_users(users)
-    logging.info(f"User created: {email}, Role: {role}")
+    audit_event("user_created", target=email, role=role)
     return True, "User created successfully."
 
 def reset_user_password(email, password):
-    users = load_users()
     email = email.lower()
-    if email not in users:
-        return False, "User not found."
-    hash_pass = hashlib.sha256(password.encode()).hexdigest()
-    users[email]["hash"] = hash_pass
-    save_users(users)
-    logging.info(f"Password reset: {email}")
+    if email not in load_users():
+        return False, "User not found.", None
+    try:
+        password_hash = hash_password(password)
+    except (AuthBusy, TimeoutError):
+        return False, SERVER_BUSY, None
+    if not get_user_directory().set_hash(email, password_hash):
+        return False, "User not found.", None
+    audit_event("password_reset", target=email)
     return True, "Password reset successfully.", password
 
 def delete_user(email):
@@ -212,7 +253,7 @@ def delete_user(email):
     if email in users:
         del users[email]
         save_users(users)
-        logging.info(f"User deleted: {email}")
+        audit_event("user_deleted", target=email)
         return True, "User deleted successfully."
     return False, "User not found."
 
@@ -229,14 +270,43 @@ def update_user(old_email, new_email, new_role):
     user_data["role"] = new_role
     users[new_email] = user_data
     save_users(users)
-    logging.info(f"User updated: {old_email} → {new_email}, Role: {new_role}")
+    audit_event("user_updated", target=old_email, new_email=new_email, role=new_role)
     return True, "User updated successfully."
 
+def _socket_peer() -> str:
+    try:
+        from streamlit.runtime import get_instance
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx()
+        client = get_instance().get_client(ctx.session_id) if ctx else None
+    except Exception:
+        return "unknown"
+    return getattr(getattr(client, "request", None), "remote_ip", None) or "unknown"
+
+def client_id() -> str:
+    """Client address for login throttling.
+
+    Entries a client puts in X-Forwarded-For itself come first, so only the one
+    appended by the outermost of TRUSTED_PROXY_HOPS proxies is used; without
+    trusted proxies it is the websocket peer address.
+    """
+    if TRUSTED_PROXY_HOPS <= 0:
+        return _socket_peer()
+    try:
+        forwarded = st.context.headers.get("X-Forwarded-For") or ""
+    except Exception:
+        forwarded = ""
+    hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+    if len(hops) < TRUSTED_PROXY_HOPS:
+        # Reached the app without passing through every proxy.
+        return _socket_peer()
+    return hops[-TRUSTED_PROXY_HOPS]
+
+@st.cache_resource
+def get_login_throttle() -> LoginThrottle:
+    return LoginThrottle()
+
 def authenticate():
-    if 'login_attempts' not in st.session_state:
-        st.session_state.login_attempts = 0
-    if 'last_attempt' not in st.session_state:
-        st.session_state.last_attempt = None
     if 'authenticated' not in st.session_state:
         st.session_state.authenticated = False
     if 'user' not in st.session_state:
@@ -250,37 +320,44 @@ def authenticate():
         username = st.text_input("Username", key="username")
         password = st.text_input("Password", type="password", key="password")
         
-        now = datetime.now()
         if st.button("Login"):
-            if st.session_state.login_attempts >= 5:
-                if st.session_state.last_attempt and (now - st.session_state.last_attempt).seconds < 300:
-                    st.error("Too many failed attempts. Try again in 5 minutes.")
-                    st.stop()
-                else:
-                    st.session_state.login_attempts = 0
-            
-            users = load_users()
             email = username if "@" in username else username + "@joval.com"
             email = email.lower()
-            if email in users:
-                if hashlib.sha256(password.encode()).hexdigest() == users[email]["hash"]:
-                    st.session_state.authenticated = True
-                    display_name = username.split("@")[0].title() if "@" in username else username.title()
-                    st.session_state.user = {"email": email, "name": display_name, "role": users[email]["role"]}
-                    st.session_state.login_attempts = 0
-                    st.success("Logged in successfully!")
-                    st.rerun()
-                else:
-                    st.session_state.login_attempts += 1
-                    st.session_state.last_attempt = now
-                    st.error("Invalid credentials.")
+            client = client_id()
+            throttle = get_login_throttle()
+            lock_seconds = throttle.locked_for(email, client)
+            if lock_seconds:
+                audit("login_locked", user=email, client=client)
+                st.error(f"Too many failed attempts. Try again in {(lock_seconds + 59) // 60} minute(s).")
+                st.stop()
+
+            users = load_users()
+            record = users.get(email)
+            try:
+                ok, new_hash = verify_password(password, record["hash"] if record else None)
+            except (AuthBusy, TimeoutError):
+                st.error(SERVER_BUSY)
+                st.stop()
+            if ok:
+                if new_hash:
+                    # Outdated hash (e.g. legacy SHA-256): store the scrypt replacement, unless an
+                    # admin changed the account while the KDF ran.
+                    get_user_directory().set_hash(email, new_hash, expected=record["hash"])
+                throttle.succeeded(email, client)
+                st.session_state.authenticated = True
+                display_name = username.split("@")[0].title() if "@" in username else username.title()
+                st.session_state.user = {"email": email, "name": display_name, "role": record["role"]}
+                audit("login", user=email, client=client)
+                st.success("Logged in successfully!")
+                st.rerun()
             else:
-                st.session_state.login_attempts += 1
-                st.session_state.last_attempt = now
+                throttle.failed(email, client)
+                audit("login_failed", user=email, client=client)
                 st.error("Invalid credentials.")
         st.stop()
 
     if st.sidebar.button("Logout"):
+        audit_event("logout")
         for key in list(st.session_state.keys()):
             del st.session_state[key]
         st.rerun()
@@ -294,7 +371,7 @@ def admin_dashboard(user):
         return
 
     st.title("Admin Dashboard")
-    tab1, tab2, tab3, tab4, tab5 = st.tabs(["Create User", "Reset Password", "List & Edit Users", "Delete User", "Upload Logo/Playbook"])
+    tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs(["Create User", "Reset Password", "List & Edit Users", "Delete User", "Upload Logo/Playbook", "Audit Timeline", "Performance"])
 
     users = load_users()
     user_emails = sorted(users.keys())
@@ -399,57 +476,224 @@ def admin_dashboard(user):
         uploaded_playbook = st.file_uploader("Upload Word Doc", type=["docx"])
         if uploaded_playbook:
             file_path = os.path.join(PLAYBOOKS_DIR, uploaded_playbook.name)
-            with open(file_path, "wb") as f:
-                f.write(uploaded_playbook.getbuffer())
+            data = uploaded_playbook.getbuffer()
+            # The uploader keeps its file across reruns; only a changed document is written and migrated.
+            if not os.path.exists(file_path) or file_digest(file_path) != hashlib.sha256(data).hexdigest():
+                registry = get_playbook_registry()
+                old_index = registry.task_index(file_path) if os.path.exists(file_path) else None
+                tmp_path = f"{file_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, file_path)
+                report = None
+                if old_index is not None:
+                    with st.spinner("Carrying progress over to the new version..."):
+                        report = migrate_playbook_progress(uploaded_playbook.name, old_index, registry.task_index(file_path))
+                st.session_state.playbook_upload_report = (uploaded_playbook.name, report)
+                audit_event("playbook_uploaded", playbook=uploaded_playbook.name, **(report or {}))
             st.success(f"Playbook uploaded!")
+            name, report = st.session_state.get("playbook_upload_report", (None, None))
+            if name == uploaded_playbook.name and report:
+                st.info(f"Progress carried over: {report['matched']} of {report['tasks']} tasks matched "
+                        f"({report['moved']} moved to new positions), {report['orphaned']} no longer in the document.")
+
+    with tab6:
+        render_audit_timeline(user_emails)
+
+    with tab7:
+        render_performance_panel()
 
     if st.button("Back to Main App"):
         st.session_state.admin_page = False
         st.rerun()
 
+AUDIT_EVENTS = ["login", "login_failed", "logout", "task_toggled", "comment_changed", "progress_saved",
+                "export_downloaded", "playbook_uploaded", "user_created", "user_updated", "user_deleted", "password_reset"]
+AUDIT_PAGE_SIZE = 50
+
+@st.cache_resource
+def get_audit_index() -> AuditIndex:
+    return AuditIndex()
+
+def audit_task_label(playbook_name: str, key: str) -> str:
+    path = os.path.join(PLAYBOOKS_DIR, playbook_name or "")
+    if not key or not os.path.exists(path):
+        return ""
+    index = get_playbook_registry().task_index(path)
+    task = index.by_key.get(key[:-len("::comment")] if key.endswith("::comment") else key)
+    if task:
+        return f"{task['ref']} {task['step']}".strip()
+    return index.section_titles.get(key, "")
+
+def render_audit_timeline(user_emails: List[str]):
+    st.subheader("Audit Timeline")
+    today = datetime.now().date()
+    c1, c2, c3, c4 = st.columns(4)
+    dates = c1.date_input("Date range", value=(today - timedelta(days=7), today), key="audit_dates")
+    user_filter = c2.selectbox("User", ["(any)"] + user_emails, key="audit_user")
+    playbook_names = sorted(f for f in os.listdir(PLAYBOOKS_DIR) if f.lower().endswith(".docx"))
+    playbook_filter = c3.selectbox("Playbook", ["(any)"] + playbook_names, key="audit_playbook")
+    event_filter = c4.selectbox("Event", ["(any)"] + AUDIT_EVENTS, key="audit_event")
+
+    start = dates[0] if dates else None
+    end = dates[1] if len(dates) > 1 else start
+    filters = {
+        "start": start.isoformat() if start else None,
+        "end": (end + timedelta(days=1)).isoformat() if end else None,
+        "user": None if user_filter == "(any)" else user_filter,
+        "playbook": None if playbook_filter == "(any)" else playbook_filter,
+        "event": None if event_filter == "(any)" else event_filter,
+    }
+    # A stack of keyset cursors; changing a filter starts again from the newest page.
+    if st.session_state.get("audit_filters") != filters:
+        st.session_state.audit_filters = filters
+        st.session_state.audit_pages = [None]
+    pages = st.session_state.audit_pages
+
+    rows = get_audit_index().query(**filters, before_id=pages[-1], limit=AUDIT_PAGE_SIZE + 1)
+    has_more = len(rows) > AUDIT_PAGE_SIZE
+    rows = rows[:AUDIT_PAGE_SIZE]
+    if rows:
+        table = [{
+            "Time": r["ts"], "Event": r["event"], "User": r["user"], "Playbook": r["playbook"],
+            "Task": audit_task_label(r["playbook"], r["key"]),
+            "Old": "" if r["old"] is None else json.dumps(r["old"]),
+            "New": "" if r["new"] is None else json.dumps(r["new"]),
+            "Detail": "" if r["detail"] is None else json.dumps(r["detail"]),
+        } for r in rows]
+        st.dataframe(pd.DataFrame(table), use_container_width=True, hide_index=True)
+    else:
+        st.info("No audit events match these filters.")
+
+    n1, n2, n3 = st.columns([1, 1, 4])
+    if n1.button("Newer", key="audit_newer", disabled=len(pages) == 1):
+        pages.pop()
+        st.rerun()
+    if n2.button("Older", key="audit_older", disabled=not has_more):
+        pages.append(rows[-1]["id"])
+        st.rerun()
+    n3.caption(f"Page {len(pages)}")
+
+def render_performance_panel():
+    st.subheader("Performance")
+    st.caption("Server time per named span in this process; p50/p95 over each span's last "
+               f"{span_recorder.window} samples. Timings from this page's own rerun appear on the next one.")
+    stats = span_recorder.snapshot()
+    if stats:
+        st.dataframe(pd.DataFrame([{
+            "Span": name, "Count": s["count"], "p50 ms": round(s["p50_ms"], 2), "p95 ms": round(s["p95_ms"], 2),
+            "Max ms": round(s["max_ms"], 2), "Last ms": round(s["last_ms"], 2), "Total s": round(s["sum_s"], 2),
+        } for name, s in stats.items()]), use_container_width=True, hide_index=True)
+    else:
+        st.info("No spans recorded yet.")
+
+    c1, c2, c3 = st.columns(3)
+    c1.download_button("Prometheus text", span_recorder.prometheus_text(), file_name="spans.txt", mime="text/plain")
+    c2.download_button("JSON lines", samples_jsonl(span_recorder.samples()), file_name="spans.jsonl", mime="application/json")
+    if c3.button("Reset", key="spans_reset"):
+        span_recorder.reset()
+        st.rerun()
+
+    dropped = dropped_count()
+    if dropped:
+        st.warning(f"{dropped} audit records were dropped because the audit writer fell behind (disk stalled?).")
+
+    registry = get_playbook_registry().stats()
+    st.caption(f"Playbook registry: {registry['bytes_used'] / 2**20:.1f} of {registry['max_bytes'] / 2**20:.0f} MB, "
+               f"{registry['hits']} hits, {registry['misses']} parses.")
+    if registry["entries"]:
+        st.dataframe(pd.DataFrame([{
+            "Playbook": e["playbook"], "Digest": e["digest"][:12], "KB": round(e["bytes"] / 1024, 1),
+        } for e in registry["entries"]]), use_container_width=True, hide_index=True)
+
 # === UTILITIES ===
-def stable_key(playbook_name: str, title: str, level: int) -> str:
-    base = f"{playbook_name}||{level}||{title}"
-    return "sec_" + hashlib.md5(base.encode("utf-8")).hexdigest()
+def audit_event(event: str, **fields):
+    """Audit an action by the signed-in user (see audit_log.audit for the record fields)."""
+    audit(event, user=(st.session_state.get("user") or {}).get("email"), **fields)
+
+@st.cache_resource
+def get_progress_store() -> ProgressStore:
+    return ProgressStore(PROGRESS_DB, PLAYBOOKS_DIR)
 
-@st.cache_data
-def progress_filepath(playbook_name: str) -> str:
-    base = os.path.splitext(playbook_name)[0]
-    return os.path.join(PLAYBOOKS_DIR, f"{base}_progress.json")
+@st.cache_resource
+def get_progress_cache() -> ProgressCache:
+    return ProgressCache(get_progress_store())
 
-@st.cache_data(show_spinner=False)
+@span("progress_load")
 def load_progress(playbook_name: str):
-    path = progress_filepath(playbook_name)
-    if os.path.exists(path):
-        try:
-            with open(path, "r", encoding="utf-8") as fh:
-                data = json.load(fh)
-                return (
-                    data.get("completed", {}),
-                    data.get("comments", {}),
-                    data.get("expanders", {})
-                )
-        except Exception as e:
-            st.warning(f"Failed to load progress: {e}")
-            return {}, {}, {}
-    return {}, {}, {}
-
-def save_progress(playbook_name: str, completed_map: dict, comments_map: dict, expanders_map: dict):
-    rec = {
-        "playbook": playbook_name,
-        "timestamp": datetime.now().isoformat(),
-        "version": "1.0",
-        "completed": completed_map,
-        "comments": comments_map,
-        "expanders": expanders_map
+    try:
+        return get_progress_cache().load(playbook_name)
+    except sqlite3.Error as e:
+        st.warning(f"Failed to load progress: {e}")
+        return {}, {}, {}
+
+@span("progress_save")
+def save_progress(playbook_name: str, completed_map: dict, comments_map: dict, expanders_map: dict) -> int:
+    """Upsert the given entries; keys not passed in are left untouched.
+
+    This is the only write path for progress, so the shared cache stays coherent.
+    """
+    return get_progress_cache().write(playbook_name, completed_map, comments_map, expanders_map)
+
+def migrate_playbook_progress(playbook_name: str, old_index: TaskIndex, new_index: TaskIndex) -> Dict[str, int]:
+    """Move saved progress from an old version of a playbook onto the new version's keys."""
+    tasks, sections = plan_moves(old_index, new_index)
+    completed, comments, _ = get_progress_store().load(playbook_name)
+    orphan_tag = datetime.now().strftime("%Y%m%d%H%M%S")
+    moves, orphaned = {}, 0
+    for old in old_index.by_key:
+        new = tasks.get(old)
+        if new is None:
+            # The task is gone. Park its progress out of the way: its key may name a different task
+            # now, or in a later version, and the parked rows stay in the database for recovery.
+            new = f"{old}::orphaned::{orphan_tag}"
+            if completed.get(old) or comments.get(f"{old}::comment"):
+                orphaned += 1
+        moves[old] = new
+        moves[f"{old}::comment"] = f"{new}::comment"
+    for old, new in sections.items():
+        # Section comments and per-user expander rows are keyed by the section key itself.
+        moves[old] = new
+        moves[get_expander_state_key(playbook_name, old)] = get_expander_state_key(playbook_name, new)
+    rows = get_progress_store().remap(playbook_name, moves)
+    return {
+        "tasks": len(old_index.by_key),
+        "matched": len(tasks),
+        "moved": sum(1 for old, new in tasks.items() if old != new),
+        "orphaned": orphaned,
+        "rows": rows,
     }
-    path = progress_filepath(playbook_name)
-    with open(path, "w", encoding="utf-8") as fh:
-        json.dump(rec, fh, indent=2)
+
+# Audit event per persisted progress kind; expander states are not audited.
+PROGRESS_AUDIT_EVENTS = {"completed": "task_toggled", "comments": "comment_changed"}
+
+def audit_progress_write(playbook_name: str, kind: str, key: str, old, new):
+    """One audit record per saved task or comment, whether auto-saved or saved with Save Progress."""
+    if kind in PROGRESS_AUDIT_EVENTS:
+        audit_event(PROGRESS_AUDIT_EVENTS[kind], playbook=playbook_name, key=key, old=old, new=new)
+
+def get_progress_writer() -> ProgressWriter:
+    if "progress_writer" not in st.session_state:
+        st.session_state.progress_writer = ProgressWriter(save_progress, audit_progress_write)
+    return st.session_state.progress_writer
+
+def session_progress(playbook_name: str, playbook_path: str) -> TaskProgress:
+    """Saved completion plus this session's ticks still waiting for Save Progress."""
+    progress = get_progress_cache().task_progress(playbook_name, get_playbook_registry().task_index(playbook_path))
+    for key, value in get_progress_writer().pending(playbook_name)["completed"].items():
+        progress.set(key, value)
+    return progress
+
+def flush_progress() -> int:
+    if "progress_writer" not in st.session_state:
+        return 0
+    return st.session_state.progress_writer.flush()
 
 def safe_image_display(src: str) -> bool:
     if not src:
         return False
+    if not src.startswith("data:") and not src.lower().endswith(WEB_IMAGE_EXTENSIONS):
+        return False
     try:
         st.markdown(f"<img style='max-width:90%;height:auto;border-radius:8px;box-shadow:0 6px 18px rgba(0,0,0,0.6);margin:12px 0;display:block;' src='{src}'/>", unsafe_allow_html=True)
         return True
@@ -510,201 +754,185 @@ def theme_selector():
         """, unsafe_allow_html=True)
     return theme
 
-@st.cache_data(ttl=300)
-def export_to_excel(completed_map: Dict, comments_map: Dict, selected_playbook: str, bulk_export: bool = False) -> bytes:
+EXPORT_COLUMNS = ["Section", "Ref", "Step", "Description", "Owner", "Done", "Comment", "Updated", "Task_Key"]
+
+def export_rows(playbook_name: str):
+    """Saved progress for one playbook, labelled from its task index and streamed from the store."""
+    path = os.path.join(PLAYBOOKS_DIR, playbook_name)
+    index = get_playbook_registry().task_index(path) if os.path.exists(path) else None
+    for key, done, comment, updated_at in get_progress_store().iter_tasks(playbook_name):
+        task = index.by_key.get(key) if index else None
+        if task:
+            yield [task["section"], task["ref"], task["step"], task["description"], task["owner"],
+                   bool(done), comment, updated_at, key]
+        else:
+            # Section notes, or keys left over from an earlier version of the document.
+            section = index.section_titles.get(key, "") if index else ""
+            yield [section, "", "", "", "", "" if done is None else bool(done), comment, updated_at, key]
+
+def excel_sheet_title(playbook_name: str, used: set) -> str:
+    base = re.sub(r'[^\w\-_]', '_', playbook_name.replace('.docx', ''))[:31]
+    title, n = base, 2
+    while title.lower() in used:
+        suffix = f"_{n}"
+        title, n = base[:31 - len(suffix)] + suffix, n + 1
+    used.add(title.lower())
+    return title
+
+def export_to_excel(selected_playbook: str, bulk_export: bool = False) -> bytes:
+    """One sheet per playbook, rows appended straight from the store through a write-only workbook."""
     if not OPENPYXL_AVAILABLE:
         return b""
-    df_completed = pd.DataFrame(list(completed_map.items()), columns=["Task_Key", "Status"])
-    df_comments = pd.DataFrame(list(comments_map.items()), columns=["Task_Key", "Comment"])
+    names = [selected_playbook]
+    if bulk_export:
+        names += [pb for pb in playbooks if pb != selected_playbook]
+    wb = openpyxl.Workbook(write_only=True)
+    used = set()
+    for pb in names:
+        ws = wb.create_sheet(excel_sheet_title(pb, used))
+        ws.append(EXPORT_COLUMNS)
+        for row in export_rows(pb):
+            ws.append(row)
     output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df_completed.to_excel(writer, sheet_name="Progress", index=False)
-        df_comments.to_excel(writer, sheet_name="Comments", index=False)
-        if bulk_export:
-            for pb in playbooks:
-                if pb != selected_playbook:
-                    comp, _ = load_progress(pb)
-                    df_pb = pd.DataFrame(list(comp.items()), columns=["Task_Key", "Status"])
-                    sheet_name = re.sub(r'[^\w\-_]', '_', pb.replace('.docx', ''))[:31]
-                    df_pb.to_excel(writer, sheet_name=sheet_name, index=False)
+    wb.save(output)
     return output.getvalue()
 
-@st.cache_data
-def export_to_csv(completed_map: Dict, comments_map: Dict, selected_playbook: str) -> bytes:
-    df = pd.DataFrame({
-        "Task_Key": list(completed_map.keys()) + list(comments_map.keys()),
-        "Status": [str(completed_map.get(k, '')) for k in completed_map.keys()] + [''] * len(comments_map),
-        "Comment": [''] * len(completed_map) + [str(v) for v in comments_map.values()]
-    })
-    return df.to_csv(index=False).encode('utf-8')
-
-# === PLAYBOOK PARSING ===
-@st.cache_data(hash_funcs={Path: lambda p: str(p)})
-def parse_playbook_cached(path: str) -> List[Dict[str, Any]]:
-    with open(path, "rb") as fh:
-        result = mammoth.convert_to_html(fh)
-        html = result.value
-    soup = BeautifulSoup(html, "html.parser")
-
-    exclude_terms = ["table of contents", "document control", "document revision", "assumptions", "disclaimer"]
-    def excluded(text: str) -> bool:
-        if not text:
-            return False
-        tl = text.strip().lower()
-        return any(ex in tl for ex in exclude_terms)
-
-    sections = []
-    stack = []
-
-    for tag in soup.find_all(['h1','h2','h3','h4','p','table','img']):
-        if tag.name.startswith('h') and tag.name[1:].isdigit():
-            title = tag.get_text().strip()
-            if excluded(title):
-                continue
-            level = int(tag.name[1])
-            node = {"title": title, "level": level, "content": [], "subs": []}
-            while stack and stack[-1]["level"] >= level:
-                stack.pop()
-            if stack:
-                stack[-1]["subs"].append(node)
-            else:
-                sections.append(node)
-            stack.append(node)
-        elif tag.name == 'p':
-            text = tag.get_text(separator="\n").strip()
-            if text and stack:
-                stack[-1]["content"].append({"type": "text", "value": text})
-        elif tag.name == 'img':
-            src = tag.get("src", "")
-            if src and stack:
-                stack[-1]["content"].append({"type": "image", "value": src})
-        elif tag.name == 'table':
-            rows = [[td.get_text(separator="\n").strip() for td in tr.find_all(["td","th"])] for tr in tag.find_all("tr")]
-            if rows and stack:
-                stack[-1]["content"].append({"type": "table", "value": rows})
-
-    def reconstruct_tables_in_section(section):
-        contents = section.get("content", [])
-        i = 0
-        new_contents = []
-        header_keywords = ["reference", "step", "description", "ownership", "responsibility"]
-        owner_keywords = ["incident response team", "irt", "ownership", "responsibility", "it team leadership", "risk management team", "grc"]
-        while i < len(contents):
-            item = contents[i]
-            if item["type"] != "text":
-                new_contents.append(item)
-                i += 1
-                continue
-            txt = item["value"].strip()
-            txt_lower = txt.lower()
-            keyword_count = sum(1 for word in header_keywords if word in txt_lower)
-            is_header_like = keyword_count >= 2
-            if is_header_like or ref_pattern.match(txt):
-                headers = ["Reference", "Step", "Description", "Ownership/Responsibility"]
-                rows = []
-                current_ref = current_step = ""
-                current_desc_parts = []
-                j = i if not is_header_like else i + 1
-                while j < len(contents) and contents[j]["type"] == "text":
-                    txt_j = contents[j]["value"].strip()
-                    if ref_pattern.match(txt_j):
-                        if current_ref:
-                            desc = " ".join(current_desc_parts)
-                            owner = current_desc_parts.pop() if current_desc_parts and any(p in current_desc_parts[-1].lower() for p in owner_keywords) else ""
-                            rows.append([current_ref, current_step, desc, owner])
-                            current_desc_parts = []
-                        match_obj = ref_pattern.match(txt_j)
-                        current_ref = match_obj.group(0)
-                        current_step = txt_j[match_obj.end():].strip()
-                    else:
-                        current_desc_parts.append(txt_j)
-                    j += 1
-                if current_ref:
-                    desc = " ".join(current_desc_parts)
-                    owner = current_desc_parts.pop() if current_desc_parts and any(p in current_desc_parts[-1].lower() for p in owner_keywords) else ""
-                    rows.append([current_ref, current_step, desc, owner])
-                if rows:
-                    new_contents.append({"type": "table", "value": [headers] + rows})
-                i = j
-            else:
-                new_contents.append(item)
-                i += 1
-        section["content"] = new_contents
-
-    def walk_and_reconstruct(nodes):
-        for n in nodes:
-            reconstruct_tables_in_section(n)
-            if n.get("subs"):
-                walk_and_reconstruct(n["subs"])
-
-    walk_and_reconstruct(sections)
-
-    def prune(node):
-        kept_subs = [sub for sub in node.get("subs", []) if prune(sub)]
-        node["subs"] = kept_subs
-        return bool(node.get("content")) or bool(kept_subs)
+def export_to_csv(selected_playbook: str) -> bytes:
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(EXPORT_COLUMNS)
+    writer.writerows(export_rows(selected_playbook))
+    return output.getvalue().encode('utf-8')
+
+EXPORT_FORMATS = {
+    "csv": ("CSV", "csv", "text/csv"),
+    "xlsx": ("Excel", "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+def export_generations(playbook_name: str, bulk_export: bool = False) -> tuple:
+    """Progress generations an export depends on; unchanged generations mean unchanged bytes."""
+    store = get_progress_store()
+    names = playbooks if bulk_export else [playbook_name]
+    return tuple((pb, store.generation(pb)) for pb in names)
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def build_export(kind: str, playbook_name: str, generations: tuple, bulk_export: bool = False) -> bytes:
+    """Export of the saved progress; `generations` is only there to key the cache."""
+    with span(f"export_{kind}"):
+        if kind == "csv":
+            return export_to_csv(playbook_name)
+        return export_to_excel(playbook_name, bulk_export)
+
+@st.fragment
+def render_export_button(kind: str, playbook_name: str, bulk_export: bool = False):
+    """Build export bytes only when asked for, and again only once progress has changed."""
+    label, ext, mime = EXPORT_FORMATS[kind]
+    bulk_export = bulk_export and kind == "xlsx"
+    generations = export_generations(playbook_name, bulk_export)
+    ready_key = f"export_ready_{kind}_{playbook_name}"
+    if st.session_state.get(ready_key) != (generations, bulk_export):
+        st.button(f"Prepare {label}", key=f"prepare_{kind}",
+                  on_click=st.session_state.__setitem__, args=(ready_key, (generations, bulk_export)))
+        return
+    with st.spinner(f"Building {label} export..."):
+        data = build_export(kind, playbook_name, generations, bulk_export)
+    if st.download_button(f"Download {label}", data,
+                          f"{os.path.splitext(playbook_name)[0]}_progress.{ext}",
+                          mime, key=f"download_{kind}"):
+        audit_event("export_downloaded", playbook=playbook_name, format=kind, bulk=bulk_export)
+
+# === PLAYBOOK REGISTRY ===
+@st.cache_resource
+def get_playbook_registry() -> PlaybookRegistry:
+    return PlaybookRegistry(PLAYBOOK_REGISTRY_MB * 1024 * 1024)
+
+@st.cache_resource
+def get_prewarmer():
+    if not PREWARM_PLAYBOOKS:
+        return None
+    paths = sorted(os.path.join(PLAYBOOKS_DIR, f) for f in os.listdir(PLAYBOOKS_DIR) if f.lower().endswith(".docx"))
+    return PlaybookPrewarmer(get_playbook_registry(), paths, PREWARM_WORKERS) if paths else None
+
+def render_prewarm_status(prewarmer):
+    if prewarmer is None:
+        return
+    if not prewarmer.finished:
+        total = len(prewarmer.paths)
+        st.sidebar.progress(prewarmer.done / max(total, 1), text=f"Preparing playbooks… {prewarmer.done}/{total}")
+    if prewarmer.errors:
+        st.sidebar.warning(f"Could not pre-load: {', '.join(sorted(prewarmer.errors))}")
 
-    return [s for s in sections if prune(s)]
+def parse_playbook_cached(path: str) -> List[Dict[str, Any]]:
+    """Parsed sections for a .docx, served from the shared registry, then the on-disk cache, then a fresh parse."""
+    return get_playbook_registry().get(path)
+
+# === CROSS-PLAYBOOK SEARCH ===
+@st.cache_resource(show_spinner=False)
+def get_search_index() -> SearchIndex:
+    return SearchIndex()
+
+def search_playbooks(query: str, limit: int = 20):
+    """Ranked hits across every playbook; shards for changed .docx files are rebuilt first."""
+    index = get_search_index()
+    paths = [os.path.join(PLAYBOOKS_DIR, f) for f in sorted(os.listdir(PLAYBOOKS_DIR)) if f.lower().endswith(".docx")]
+    if index.refresh(paths, parse_playbook_cached):
+        logging.info(f"Search index refreshed: {index.stats()}")
+    return timed_search(index, query, limit)
+
+def open_search_hit(playbook_name: str, top_title: str, top_level: int):
+    """Button callback: switch to the hit's playbook with its top-level section expanded."""
+    sec_key = stable_key(playbook_name, top_title, top_level)
+    st.session_state["select_playbook"] = playbook_name
+    st.session_state[get_expander_state_key(playbook_name, sec_key)] = True
+    save_expander_state(playbook_name, sec_key, True)
+
+def render_playbook_search():
+    st.sidebar.markdown('<div class="sidebar-subheader">Search All Playbooks</div>', unsafe_allow_html=True)
+    query = st.sidebar.text_input("Search all playbooks", key="global_search", placeholder="e.g. MFA reset", label_visibility="collapsed")
+    if not query.strip():
+        return
+    with st.spinner("Indexing playbooks..."):
+        results, elapsed_ms = search_playbooks(query)
+    st.sidebar.caption(f"{len(results)} results in {elapsed_ms:.1f} ms")
+    for i, hit in enumerate(results):
+        title = hit["section"][0]
+        st.sidebar.markdown(f"**{os.path.splitext(hit['playbook'])[0]}** › {title}  \n<small>{hit['snippet']}</small>", unsafe_allow_html=True)
+        st.sidebar.button("Open", key=f"search_hit_{i}", on_click=open_search_hit, args=(hit["playbook"], *hit["top"]))
 
 # === RENDERING ===
-ACTION_HEADERS = {"reference","ref","step","description","ownership","responsibility","owner","responsible"}
-
-def is_action_table(rows: List[List[str]]) -> bool:
-    if not rows:
-        return False
-    headers = [h.strip().lower() for h in rows[0]]
-    hits = sum(1 for h in headers if any(k in h for k in ACTION_HEADERS))
-    return hits >= 2 or (len(rows[0]) >= 4 and ref_pattern.match(rows[0][0].strip()))
-
-# Global counter for progress
-task_counter = {"total": 0, "done": 0}
-
-def render_action_table(playbook_name, sec_key, rows, completed_map, comments_map, autosave, table_index=0):
-    global task_counter
-    default_headers = ["Reference", "Step", "Description", "Ownership/Responsibility"]
-    headers = rows[0] if len(rows) > 0 and not ref_pattern.match(rows[0][0].strip() if rows[0] else "") else default_headers
-    data_rows = rows[1:] if len(rows) > 1 else rows
-    for row in data_rows:
-        while len(row) < 4:
-            row.append("")
-
-    task_counter["total"] += len(data_rows)
-
+@st.fragment
+@span("action_table")
+def render_action_table(playbook_name, sec_key, table_index, progress, comments_map):
+    """One action table as a fragment: ticking a row reruns this table, not the whole page."""
     st.caption("Mark tasks complete and add notes.")
     cols = st.columns([1, 2, 4, 2, 1, 2])
     for i, h in enumerate(["Ref", "Step", "Desc", "Owner", "Done", "Comment"]):
         cols[i].write(h)
 
-    changed = False
-    table_key = f"{sec_key}::tbl::{table_index}"
-    for ridx, row in enumerate(data_rows):
-        row_key = f"{table_key}::row::{ridx}"
-        comment_key = f"{row_key}::comment"
-        ref = row[0]; step = row[1]; desc = " ".join(row[2:-1]); owner = row[-1]
-        prev_val = completed_map.get(row_key, False)
+    writer = get_progress_writer()
+    pct_before = progress.pct
+    for task in progress.index.tables.get((sec_key, table_index), ()):
+        row_key = task["key"]
+        comment_key = task["comment_key"]
+        prev_val = progress.is_done(task["id"])
         prev_comment = comments_map.get(comment_key, "")
 
-        cb_key = f"cb_{playbook_name}_{sec_key}_{table_index}_{ridx}"
-        ci_key = f"ci_{playbook_name}_{sec_key}_{table_index}_{ridx}"
-
         cols = st.columns([1, 2, 4, 2, 1, 2])
-        cols[0].write(ref); cols[1].write(step); cols[2].write(desc); cols[3].write(owner)
-        new_val = cols[4].checkbox("", value=prev_val, key=cb_key)
-        new_comment = cols[5].text_input("", value=prev_comment, key=ci_key, label_visibility="collapsed")
+        cols[0].write(task["ref"]); cols[1].write(task["step"]); cols[2].write(task["description"]); cols[3].write(task["owner"])
+        new_val = cols[4].checkbox("", value=prev_val, key=task["cb_key"])
+        new_comment = cols[5].text_input("", value=prev_comment, key=task["ci_key"], label_visibility="collapsed")
 
         if new_val != prev_val:
-            completed_map[row_key] = new_val
-            changed = True
-            if new_val:
-                task_counter["done"] += 1
-            else:
-                task_counter["done"] -= 1
+            progress.set(row_key, new_val)
+            writer.mark(playbook_name, "completed", row_key, new_val, old=prev_val)
         if new_comment != prev_comment:
             comments_map[comment_key] = new_comment
-            changed = True
-
-    if autosave and changed:
-        save_progress(playbook_name, completed_map, comments_map, st.session_state.get("expanders", {}))
+            writer.mark(playbook_name, "comments", comment_key, new_comment, old=prev_comment)
+    # Fragment reruns skip the end-of-script flush; with auto-save off this leaves the edits queued.
+    writer.flush()
+    if progress.pct != pct_before:
+        # The bar and badges are outside this fragment; redraw the page only when they change.
+        st.rerun(scope="app")
 
 def render_generic_table(rows: List[List[str]]):
     if len(rows) > 1:
@@ -713,7 +941,7 @@ def render_generic_table(rows: List[List[str]]):
         df = pd.DataFrame(rows)
     st.dataframe(df, use_container_width=True, hide_index=True)
 
-def render_section_content(section, playbook_name, completed_map, comments_map, autosave, sec_key, is_sub=False):
+def render_section_content(section, playbook_name, progress, comments_map, sec_key, is_sub=False):
     table_idx = 0
     for item in section.get("content", []):
         t = item.get("type")
@@ -726,29 +954,46 @@ def render_section_content(section, playbook_name, completed_map, comments_map,
             rows = item.get("value", [])
             if rows:
                 if is_action_table(rows):
-                    render_action_table(playbook_name, sec_key, rows, completed_map, comments_map, autosave, table_idx)
+                    render_action_table(playbook_name, sec_key, table_idx, progress, comments_map)
                     table_idx += 1
                 else:
                     render_generic_table(rows)
     for sub in section.get("subs", []):
         sub_key = stable_key(playbook_name, sub["title"], sub["level"])
         st.markdown(f"<div id='{sub_key}' style='margin-top:12px;'><strong style='color:var(--text);'>{sub['title']}</strong></div>", unsafe_allow_html=True)
-        render_section_content(sub, playbook_name, completed_map, comments_map, autosave, sub_key, True)
+        render_section_content(sub, playbook_name, progress, comments_map, sub_key, True)
     if not is_sub:
-        st.markdown("<div style='font-weight:700;margin-top:12px;margin-bottom:6px;'>Comments / Notes</div>", unsafe_allow_html=True)
-        prev_sec_comment = comments_map.get(sec_key, "")
-        sec_comment_key = f"sec_cmt_{playbook_name}_{sec_key}"
-        new_sec_comment = st.text_area("", value=prev_sec_comment, key=sec_comment_key, height=120, label_visibility="collapsed")
-        if new_sec_comment != prev_sec_comment:
-            comments_map[sec_key] = new_sec_comment
-            if autosave:
-                save_progress(playbook_name, completed_map, comments_map, st.session_state.get("expanders", {}))
+        render_section_comment(playbook_name, sec_key, comments_map)
+
+@st.fragment
+def render_section_comment(playbook_name, sec_key, comments_map):
+    st.markdown("<div style='font-weight:700;margin-top:12px;margin-bottom:6px;'>Comments / Notes</div>", unsafe_allow_html=True)
+    prev_sec_comment = comments_map.get(sec_key, "")
+    sec_comment_key = f"sec_cmt_{playbook_name}_{sec_key}"
+    new_sec_comment = st.text_area("", value=prev_sec_comment, key=sec_comment_key, height=120, label_visibility="collapsed")
+    if new_sec_comment != prev_sec_comment:
+        comments_map[sec_key] = new_sec_comment
+        writer = get_progress_writer()
+        writer.mark(playbook_name, "comments", sec_key, new_sec_comment, old=prev_sec_comment)
+        writer.flush()
 
 def get_expander_state_key(playbook_name: str, sec_key: str) -> str:
     return f"exp_{playbook_name}_{sec_key}"
 
+def _expander_user():
+    if EXPANDER_STATE_SCOPE != "user":
+        return None
+    return (st.session_state.get("user") or {}).get("email")
+
 def load_expander_states(playbook_name: str, sections: List[Dict]) -> Dict[str, bool]:
     _, _, saved_states = load_progress(playbook_name)
+    user = _expander_user()
+    if user:
+        # Users who never toggled anything start from the shared state.
+        saved_states.update(
+            (get_expander_state_key(playbook_name, k), v)
+            for k, v in get_progress_store().load_user_expanders(user, playbook_name).items()
+        )
     states = {}
     for sec in sections:
         key = stable_key(playbook_name, sec["title"], sec["level"])
@@ -760,19 +1005,54 @@ def load_expander_states(playbook_name: str, sections: List[Dict]) -> Dict[str,
             states[sub_key] = saved_states.get(sub_state_key, False)
     return states
 
+def save_expander_states(playbook_name: str, states: Dict[str, bool]):
+    """Persist many section expander states (sec_key -> expanded) in a single write."""
+    if not states:
+        return
+    user = _expander_user()
+    if user:
+        get_progress_store().save_user_expanders(user, playbook_name, states)
+        return
+    writer = get_progress_writer()
+    for sec_key, state in states.items():
+        writer.mark(playbook_name, "expanders", get_expander_state_key(playbook_name, sec_key), state)
+
 def save_expander_state(playbook_name: str, sec_key: str, state: bool):
-    completed, comments, expanders = load_progress(playbook_name)
-    expanders[get_expander_state_key(playbook_name, sec_key)] = state
-    save_progress(playbook_name, completed, comments, expanders)
+    save_expander_states(playbook_name, {sec_key: state})
+
+def set_all_expanders(playbook_name: str, sections: List[Dict], expanded: bool):
+    states = {}
+    for sec in sections:
+        states[stable_key(playbook_name, sec["title"], sec["level"])] = expanded
+        for sub in sec.get("subs", []):
+            states[stable_key(playbook_name, sub["title"], sub["level"])] = expanded
+    for sec_key in states:
+        st.session_state[get_expander_state_key(playbook_name, sec_key)] = expanded
+    save_expander_states(playbook_name, states)
 
-def render_section(section, playbook_name, completed_map, comments_map, autosave, expander_states):
+def render_section(section, playbook_name, progress, comments_map, expander_states):
     sec_key = stable_key(playbook_name, section["title"], section["level"])
     title_class = "nist-incident-section" if section["title"] == "NIST Incident Handling Categories" else "section-title"
     st.markdown(f"<div class='{title_class}' id='{sec_key}'>{section['title']}</div>", unsafe_allow_html=True)
     
     state_key = get_expander_state_key(playbook_name, sec_key)
     if state_key not in st.session_state:
-        st.session_state[state_key] = False
+        st.session_state[state_key] = expander_states.get(sec_key, False)
+
+    if LAZY_SECTIONS:
+        # A keyed toggle reports its state back, unlike st.expander, so collapsed content can be skipped.
+        expanded = st.toggle("Expand section", key=state_key)
+        if expanded != expander_states.get(sec_key, False):
+            save_expander_state(playbook_name, sec_key, expanded)
+            expander_states[sec_key] = expanded
+        if expanded:
+            with st.container(border=True):
+                render_section_content(section, playbook_name, progress, comments_map, sec_key)
+        else:
+            done, total = progress.section(sec_key)
+            if total:
+                st.caption(f"{done}/{total} tasks complete")
+        return
 
     with st.expander("Expand section", expanded=st.session_state[state_key]):
         current_state = st.session_state[state_key]
@@ -781,10 +1061,76 @@ def render_section(section, playbook_name, completed_map, comments_map, autosave
             save_expander_state(playbook_name, sec_key, current_state)
             expander_states[sec_key] = current_state
         
-        render_section_content(section, playbook_name, completed_map, comments_map, autosave, sec_key)
+        render_section_content(section, playbook_name, progress, comments_map, sec_key)
+
+@st.fragment(run_every=PROGRESS_REFRESH_SECONDS)
+def render_progress_panel(playbook_name: str, playbook_path: str):
+    """Progress bar, badges and bottom toolbar."""
+    progress = session_progress(playbook_name, playbook_path)
+    pct = progress.pct
+    badges = calculate_badges(pct)
+
+    if progress.total > 0:
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            st.info(f"**Progress:** {pct}% – {', '.join(badges)}")
+        with col2:
+            if st.button("Gamify!"):
+                st.session_state.gamify = not st.session_state.gamify
+                if st.session_state.gamify:
+                    st.session_state.gamify_count = st.session_state.get("gamify_count", 0) + 1
+                    if st.session_state.gamify_count % 2 == 1:
+                        st.balloons()
+                    else:
+                        st.snow()
+
+        st.markdown(f"<div class='progress-wrap'><div class='progress-fill' style='width:{pct}%'></div></div>", unsafe_allow_html=True)
+    else:
+        st.warning("No actionable tasks found in this playbook.")
+
+    # === BOTTOM TOOLBAR ===
+    st.markdown(f"""
+    <div class="bottom-toolbar">
+        <div>© Joval Wines – Better Never Stops</div>
+        <div>Progress: {pct}%</div>
+    </div>
+    """, unsafe_allow_html=True)
 
 # === MAIN APP ===
+@span("toc")
+def render_toc(selected_playbook: str, sections: List[Dict]):
+    toc_items = []
+    def collect_toc(secs):
+        for s in secs:
+            key = stable_key(selected_playbook, s["title"], s["level"])
+            toc_items.append({"title": s["title"], "anchor": key})
+            if s.get("subs"):
+                collect_toc(s["subs"])
+    collect_toc(sections)
+
+    search_term = st.text_input("Search sections...", key="toc_search", label_visibility="collapsed")
+    filtered_toc = [
+        item for item in toc_items
+        if search_term.lower() in item["title"].lower()
+    ] if search_term else toc_items
+
+    toc_links = "".join(
+        f'<a href="#{item["anchor"]}" class="toc-item" onclick="document.getElementById(\'{item["anchor"]}\').scrollIntoView();return false;">{item["title"]}</a>'
+        for item in filtered_toc
+    )
+    toc_html = f"""
+    <div style="position:fixed;left:1rem;top:110px;bottom:100px;width:250px;background:#fff;padding:1rem;border-radius:8px;overflow:auto;box-shadow:0 2px 6px rgba(0,0,0,.04);border:1px solid #eaeaea;">
+        <div class="toc-search"><input type="text" placeholder="Search sections..." value="{search_term}" /></div>
+        <h4 style="margin:0.5rem 0 0.75rem 0;">Table of Contents</h4>
+        <div style="max-height:calc(100% - 80px);overflow-y:auto;">
+            {toc_links if toc_links else '<em>No matches</em>'}
+        </div>
+    </div>
+    """
+    st.markdown(toc_html, unsafe_allow_html=True)
+
 def main():
+    prewarmer = get_prewarmer()
     user = authenticate()
     st.sidebar.info(f"Logged in as: **{user['name']}** – *{get_user_role(user['email'])}*")
 
@@ -814,8 +1160,13 @@ def main():
 
     # === SIDEBAR CONTROLS ===
     st.sidebar.markdown('<div class="sidebar-header">Controls</div>', unsafe_allow_html=True)
+    render_prewarm_status(prewarmer)
     autosave = st.sidebar.checkbox("Auto-save progress", value=True)
+    get_progress_writer().deferred = not autosave
     bulk_export = st.sidebar.checkbox("Bulk export")
+    if SEARCH_AVAILABLE:
+        st.sidebar.markdown("---")
+        render_playbook_search()
     st.sidebar.markdown("---")
     st.sidebar.markdown('<div class="sidebar-subheader">NIST Resources</div>', unsafe_allow_html=True)
     resources = {
@@ -866,142 +1217,74 @@ def main():
     """, unsafe_allow_html=True)
 
     # === LOAD PLAYBOOK ===
-    parsed_key = f"parsed::{selected_playbook}"
-    if parsed_key not in st.session_state:
-        st.session_state[parsed_key] = parse_playbook_cached(os.path.join(PLAYBOOKS_DIR, selected_playbook))
-    sections = st.session_state[parsed_key]
-
-    completed_map, comments_map, _ = load_progress(selected_playbook)
+    # Shared across sessions via the registry; nothing per-user is kept in session_state.
+    playbook_path = os.path.join(PLAYBOOKS_DIR, selected_playbook)
+    if prewarmer is not None:
+        # Join a warm-up parse already underway rather than starting a second one.
+        prewarmer.wait_for(playbook_path)
+    sections = parse_playbook_cached(playbook_path)
+
+    _, comments_map, _ = load_progress(selected_playbook)
     expander_states = load_expander_states(selected_playbook, sections)
 
-    # === RESET PROGRESS COUNTER ===
-    task_counter["total"] = 0
-    task_counter["done"] = 0
+    # === TASK COUNTERS ===
+    # Completion bitset built from the parsed model and kept current by cached writes; widget changes adjust this copy.
+    progress = session_progress(selected_playbook, playbook_path)
+    # Comments still waiting for Save Progress, including those in sections collapsed since.
+    comments_map.update(get_progress_writer().pending(selected_playbook)["comments"])
 
     # === TOC WITH SEARCH ===
-    toc_items = []
-    def collect_toc(secs):
-        for s in secs:
-            key = stable_key(selected_playbook, s["title"], s["level"])
-            toc_items.append({"title": s["title"], "anchor": key})
-            if s.get("subs"):
-                collect_toc(s["subs"])
-    collect_toc(sections)
-
-    search_term = st.text_input("Search sections...", key="toc_search", label_visibility="collapsed")
-    filtered_toc = [
-        item for item in toc_items
-        if search_term.lower() in item["title"].lower()
-    ] if search_term else toc_items
-
-    toc_links = "".join(
-        f'<a href="#{item["anchor"]}" class="toc-item" onclick="document.getElementById(\'{item["anchor"]}\').scrollIntoView();return false;">{item["title"]}</a>'
-        for item in filtered_toc
-    )
-    toc_html = f"""
-    <div style="position:fixed;left:1rem;top:110px;bottom:100px;width:250px;background:#fff;padding:1rem;border-radius:8px;overflow:auto;box-shadow:0 2px 6px rgba(0,0,0,.04);border:1px solid #eaeaea;">
-        <div class="toc-search"><input type="text" placeholder="Search sections..." value="{search_term}" /></div>
-        <h4 style="margin:0.5rem 0 0.75rem 0;">Table of Contents</h4>
-        <div style="max-height:calc(100% - 80px);overflow-y:auto;">
-            {toc_links if toc_links else '<em>No matches</em>'}
-        </div>
-    </div>
-    """
-    st.markdown(toc_html, unsafe_allow_html=True)
+    render_toc(selected_playbook, sections)
 
     # === EXPAND / COLLAPSE ALL BUTTONS (REINSTATED) ===
     st.markdown("<div style='text-align:center;margin:1.5rem 0;'>", unsafe_allow_html=True)
     col1, col2, col3 = st.columns([1, 1, 3])
     with col1:
         if st.button("Expand All", key="expand_all"):
-            for sec in sections:
-                key = stable_key(selected_playbook, sec["title"], sec["level"])
-                save_expander_state(selected_playbook, key, True)
-                st.session_state[get_expander_state_key(selected_playbook, key)] = True
-                for sub in sec.get("subs", []):
-                    sub_key = stable_key(selected_playbook, sub["title"], sub["level"])
-                    save_expander_state(selected_playbook, sub_key, True)
-                    st.session_state[get_expander_state_key(selected_playbook, sub_key)] = True
+            set_all_expanders(selected_playbook, sections, True)
             st.success("All sections expanded!")
             st.rerun()
     with col2:
         if st.button("Collapse All", key="collapse_all"):
-            for sec in sections:
-                key = stable_key(selected_playbook, sec["title"], sec["level"])
-                save_expander_state(selected_playbook, key, False)
-                st.session_state[get_expander_state_key(selected_playbook, key)] = False
-                for sub in sec.get("subs", []):
-                    sub_key = stable_key(selected_playbook, sub["title"], sub["level"])
-                    save_expander_state(selected_playbook, sub_key, False)
-                    st.session_state[get_expander_state_key(selected_playbook, sub_key)] = False
+            set_all_expanders(selected_playbook, sections, False)
             st.success("All sections collapsed!")
             st.rerun()
     st.markdown("</div>", unsafe_allow_html=True)
 
     # === CONTENT ===
     st.markdown('<div class="content-wrap">', unsafe_allow_html=True)
-    for sec in sections:
-        render_section(sec, selected_playbook, completed_map, comments_map, autosave, expander_states)
+    with span("render_sections"):
+        for sec in sections:
+            render_section(sec, selected_playbook, progress, comments_map, expander_states)
     st.markdown('</div>', unsafe_allow_html=True)
 
-    # === FINAL PROGRESS CALCULATION ===
-    done = sum(1 for k, v in completed_map.items() if v and "::row::" in k)
-    total = task_counter["total"]
-    pct = int((done / max(total, 1)) * 100) if total > 0 else 0
-    badges = calculate_badges(pct)
-
     # === SHOW PROGRESS BAR ===
-    if total > 0:
-        col1, col2 = st.columns([3, 1])
-        with col1:
-            st.info(f"**Progress:** {pct}% – {', '.join(badges)}")
-        with col2:
-            if st.button("Gamify!"):
-                st.session_state.gamify = not st.session_state.gamify
-                if st.session_state.gamify:
-                    st.session_state.gamify_count = st.session_state.get("gamify_count", 0) + 1
-                    if st.session_state.gamify_count % 2 == 1:
-                        st.balloons()
-                    else:
-                        st.snow()
-
-        st.markdown(f"<div class='progress-wrap'><div class='progress-fill' style='width:{pct}%'></div></div>", unsafe_allow_html=True)
-    else:
-        st.warning("No actionable tasks found in this playbook.")
-
-    # === SAVE ON CHANGE ===
-    if autosave:
-        save_progress(selected_playbook, completed_map, comments_map, expander_states)
+    # Include this run's own edits before the panel reads the shared counters.
+    flush_progress()
+    render_progress_panel(selected_playbook, playbook_path)
 
     # === ACTION BUTTONS ===
     st.markdown("### Actions")
     col_a, col_b, col_c = st.columns(3)
     with col_a:
         if st.button("Save Progress"):
-            save_progress(selected_playbook, completed_map, comments_map, expander_states)
+            get_progress_writer().flush(force=True)
+            save_expander_states(selected_playbook, expander_states)
+            audit_event("progress_saved", playbook=selected_playbook)
             st.success("Progress & expander states saved!")
-        st.download_button("Download CSV", 
-                           export_to_csv(completed_map, comments_map, selected_playbook),
-                           f"{os.path.splitext(selected_playbook)[0]}_progress.csv",
-                           "text/csv")
+        render_export_button("csv", selected_playbook)
     with col_b:
         if st.button("Refresh"):
             st.rerun()
         if OPENPYXL_AVAILABLE:
-            st.download_button("Download Excel", 
-                               export_to_excel(completed_map, comments_map, selected_playbook, bulk_export),
-                               f"{os.path.splitext(selected_playbook)[0]}_progress.xlsx",
-                               "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+            render_export_button("xlsx", selected_playbook, bulk_export)
 
     show_feedback()
 
-    # === BOTTOM TOOLBAR ===
-    st.markdown(f"""
-    <div class="bottom-toolbar">
-        <div>© Joval Wines – Better Never Stops</div>
-        <div>Progress: {pct}%</div>
-    </div>
-    """, unsafe_allow_html=True)
-
 if __name__ == "__main__":
-    main()
+    try:
+        with span("rerun"):
+            main()
+    finally:
+        # Runs on st.rerun()/st.stop() too, so each rerun ends in at most one write.
+        flush_progress()
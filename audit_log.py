@@ -0,0 +1,234 @@
+# audit_log.py
+"""Structured audit trail: one JSON object per line, written off the request thread.
+
+audit() only builds a LogRecord and puts it on a bounded in-memory queue; a
+QueueListener thread owns the file and does the formatting, writing and
+rotation. If the queue is full (the disk has stalled), records are dropped and
+counted rather than making a Streamlit rerun wait.
+
+The same listener also feeds AuditIndex, a SQLite table indexed by time, user
+and playbook, which serves the admin timeline without reading the JSON file.
+"""
+import os
+import json
+import glob
+import queue
+import atexit
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+from typing import Any, Dict, Iterator, List, Optional
+
+AUDIT_LOG_FILE = os.environ.get("AUDIT_LOG_FILE", "audit.jsonl")
+AUDIT_LOG_MAX_BYTES = int(os.environ.get("AUDIT_LOG_MAX_BYTES", str(5 * 1024 * 1024)))
+AUDIT_LOG_BACKUPS = int(os.environ.get("AUDIT_LOG_BACKUPS", "10"))
+# Set to a TimedRotatingFileHandler interval ("midnight", "H", "W0", ...) to rotate by time instead of size.
+AUDIT_LOG_ROTATE_WHEN = os.environ.get("AUDIT_LOG_ROTATE_WHEN", "")
+AUDIT_QUEUE_SIZE = int(os.environ.get("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_DB = os.environ.get("AUDIT_DB", "audit.db")
+AUDIT_FIELDS = ("user", "playbook", "key", "old", "new")
+
+_logger = logging.getLogger("audit")
+_listener: Optional[QueueListener] = None
+_start_lock = threading.Lock()
+dropped = 0
+
+def record_entry(record: logging.LogRecord) -> Dict[str, Any]:
+    entry = {"ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"), "event": record.getMessage()}
+    entry.update(getattr(record, "audit", {}))
+    return entry
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(record_entry(record), ensure_ascii=False, default=str)
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that never blocks: a full queue drops the record."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting happens on the listener thread; the record only carries plain data.
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        global dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped += 1
+
+def _file_handler() -> logging.Handler:
+    if AUDIT_LOG_ROTATE_WHEN:
+        handler = TimedRotatingFileHandler(AUDIT_LOG_FILE, when=AUDIT_LOG_ROTATE_WHEN,
+                                           backupCount=AUDIT_LOG_BACKUPS, encoding="utf-8")
+    else:
+        handler = RotatingFileHandler(AUDIT_LOG_FILE, maxBytes=AUDIT_LOG_MAX_BYTES,
+                                      backupCount=AUDIT_LOG_BACKUPS, encoding="utf-8")
+    handler.setFormatter(JsonLinesFormatter())
+    return handler
+
+class AuditIndex:
+    """Audit records in SQLite for timeline queries.
+
+    A time range is filtered on ts itself (events_ts), not mapped to ids: ts is
+    local wall-clock time and ids are arrival order, and the two disagree across a
+    clock change or a backfill of rotated files. Other filters walk an (x, id)
+    index newest-first. Pages are fetched by keyset (before_id), never by OFFSET,
+    so the cost of a page does not grow with the size of the log.
+    """
+
+    def __init__(self, path: str = AUDIT_DB):
+        self.path = path
+        conn = self._connect()
+        try:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS events (
+                    id INTEGER PRIMARY KEY,
+                    ts TEXT NOT NULL,
+                    event TEXT NOT NULL,
+                    user TEXT,
+                    playbook TEXT,
+                    key TEXT,
+                    old TEXT,
+                    new TEXT,
+                    detail TEXT
+                );
+                CREATE INDEX IF NOT EXISTS events_ts ON events (ts);
+                CREATE INDEX IF NOT EXISTS events_user ON events (user, id);
+                CREATE INDEX IF NOT EXISTS events_playbook ON events (playbook, id);
+                CREATE INDEX IF NOT EXISTS events_event ON events (event, id);
+            """)
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @staticmethod
+    def row(entry: Dict[str, Any]) -> tuple:
+        def as_json(value):
+            return None if value is None else json.dumps(value, ensure_ascii=False, default=str)
+        return (entry["ts"], entry["event"], entry.get("user"), entry.get("playbook"), entry.get("key"),
+                as_json(entry.get("old")), as_json(entry.get("new")), as_json(entry.get("detail")))
+
+    def insert(self, conn: sqlite3.Connection, entries):
+        with conn:
+            conn.executemany("INSERT INTO events (ts, event, user, playbook, key, old, new, detail) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (self.row(e) for e in entries))
+
+    def backfill(self, conn: sqlite3.Connection, log_file: str = AUDIT_LOG_FILE):
+        """Stream the JSON-lines files, oldest rotation first, into an empty index."""
+        if conn.execute("SELECT 1 FROM events LIMIT 1").fetchone():
+            return
+        files = glob.glob(glob.escape(log_file)) + glob.glob(glob.escape(log_file) + ".*")
+        for path in sorted(files, key=os.path.getmtime):
+            self.insert(conn, (e for e in read_audit(path) if "ts" in e and "event" in e))
+
+    def query(self, start: str = None, end: str = None, user: str = None, playbook: str = None,
+              event: str = None, before_id: int = None, limit: int = 50) -> List[Dict[str, Any]]:
+        """Newest-first page of events; pass the last id of a page as before_id for the next one."""
+        conn = self._connect()
+        try:
+            where, params = [], []
+            if start:
+                where.append("ts >= ?")
+                params.append(start)
+            if end:
+                where.append("ts < ?")
+                params.append(end)
+            if before_id is not None:
+                where.append("id < ?")
+                params.append(before_id)
+            for column, value in (("user", user), ("playbook", playbook), ("event", event)):
+                if value:
+                    where.append(f"{column} = ?")
+                    params.append(value)
+            sql = "SELECT id, ts, event, user, playbook, key, old, new, detail FROM events"
+            if where:
+                sql += " WHERE " + " AND ".join(where)
+            cur = conn.execute(sql + " ORDER BY id DESC LIMIT ?", params + [limit])
+            columns = [c[0] for c in cur.description]
+            rows = []
+            for values in cur:
+                entry = dict(zip(columns, values))
+                for name in ("old", "new", "detail"):
+                    if entry[name] is not None:
+                        entry[name] = json.loads(entry[name])
+                rows.append(entry)
+            return rows
+        finally:
+            conn.close()
+
+class AuditIndexHandler(logging.Handler):
+    """Listener-side handler that appends each record to the AuditIndex."""
+
+    def __init__(self, index: AuditIndex):
+        super().__init__()
+        self.index = index
+        self._conn = None
+
+    def backfill(self):
+        """Load existing audit files into an empty index; call before the listener starts."""
+        conn = self.index._connect()
+        try:
+            self.index.backfill(conn)
+        finally:
+            conn.close()
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            if self._conn is None:
+                # Opened on the listener thread, which is the only thread that uses it.
+                self._conn = self.index._connect()
+            self.index.insert(self._conn, [record_entry(record)])
+        except Exception:
+            self.handleError(record)
+
+def start_audit_logging() -> QueueListener:
+    """Start the writer thread once per process; later calls return the running listener."""
+    global _listener
+    with _start_lock:
+        if _listener is None:
+            records: "queue.Queue[logging.LogRecord]" = queue.Queue(AUDIT_QUEUE_SIZE)
+            _logger.setLevel(logging.INFO)
+            _logger.propagate = False
+            _logger.addHandler(DroppingQueueHandler(records))
+            # Backfill now, so the timeline shows the existing trail before anyone acts, and
+            # before the listener can add a record to the files the backfill reads.
+            index_handler = AuditIndexHandler(AuditIndex())
+            index_handler.backfill()
+            _listener = QueueListener(records, index_handler, _file_handler())
+            _listener.start()
+            # Drain what is queued on interpreter exit.
+            atexit.register(_listener.stop)
+    return _listener
+
+def audit(event: str, user: str = None, playbook: str = None, key: str = None,
+          old: Any = None, new: Any = None, **detail):
+    """Record one audit event; returns immediately."""
+    fields = {name: value for name, value in zip(AUDIT_FIELDS, (user, playbook, key, old, new)) if value is not None}
+    if detail:
+        fields["detail"] = detail
+    _logger.info(event, extra={"audit": fields})
+
+def dropped_count() -> int:
+    """Records lost to a full queue since this process started."""
+    return dropped
+
+def read_audit(path: str = AUDIT_LOG_FILE, **filters) -> Iterator[Dict[str, Any]]:
+    """Yield records from one audit file whose fields equal every given filter."""
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            for line in fh:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if all(entry.get(name) == value for name, value in filters.items()):
+                    yield entry
+    except FileNotFoundError:
+        return
@@ -0,0 +1,254 @@
+# auth.py
+"""Password hashing, verification and login throttling.
+
+Passwords are stored as salted scrypt hashes ("scrypt$n$r$p$salt$hash", base64
+fields). scrypt is memory-hard and hashlib runs it with the GIL released, but each
+call still costs ~16 MB and tens of milliseconds, so every hash or verify goes
+through one bounded thread pool: a burst of logins queues there (or is turned
+away when the queue is full) instead of piling up CPU and memory on the server.
+
+Hashes written before scrypt (bare hex SHA-256) still verify; verify_password()
+returns a replacement hash for them so the caller can upgrade the stored record.
+
+UserDirectory keeps users.json in memory for role and hash lookups.
+
+LoginThrottle is the process-wide lockout table. Failures are counted per
+(account, client) pair and per account, so opening a new browser tab no longer
+resets the count, and one client's guessing locks out only that client until the
+much higher account-wide limit is reached.
+"""
+import os
+import hmac
+import json
+import time
+import base64
+import hashlib
+import secrets
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+SCRYPT_N = int(os.environ.get("AUTH_SCRYPT_N", str(2 ** 14)))
+SCRYPT_R = int(os.environ.get("AUTH_SCRYPT_R", "8"))
+SCRYPT_P = int(os.environ.get("AUTH_SCRYPT_P", "1"))
+SALT_BYTES = 16
+KEY_BYTES = 32
+# Concurrent KDF runs, and how many more may wait before logins are refused as busy.
+AUTH_WORKERS = int(os.environ.get("AUTH_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+AUTH_QUEUE = int(os.environ.get("AUTH_QUEUE", "32"))
+AUTH_TIMEOUT_SECONDS = float(os.environ.get("AUTH_TIMEOUT_SECONDS", "10"))
+LOGIN_MAX_ATTEMPTS = int(os.environ.get("LOGIN_MAX_ATTEMPTS", "5"))
+# An account is locked for everyone once this many failures arrive from any clients.
+LOGIN_MAX_ACCOUNT_ATTEMPTS = int(os.environ.get("LOGIN_MAX_ACCOUNT_ATTEMPTS", "20"))
+LOGIN_LOCKOUT_SECONDS = int(os.environ.get("LOGIN_LOCKOUT_SECONDS", "300"))
+LOGIN_TABLE_SIZE = 10000
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(AUTH_WORKERS + AUTH_QUEUE)
+
+class AuthBusy(Exception):
+    """The hashing pool is saturated; the caller should ask the user to retry."""
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p,
+                          maxmem=2 * 128 * n * r * p, dklen=KEY_BYTES)
+
+def _hash_password(password: str) -> str:
+    salt = secrets.token_bytes(SALT_BYTES)
+    key = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(key)}"
+
+def needs_rehash(stored: str) -> bool:
+    if not stored.startswith("scrypt$"):
+        return True
+    return stored.split("$")[1:4] != [str(SCRYPT_N), str(SCRYPT_R), str(SCRYPT_P)]
+
+def _verify_password(password: str, stored: Optional[str]) -> Tuple[bool, Optional[str]]:
+    if not stored:
+        # Unknown account: spend the same time as a real check so timing does not reveal it.
+        _scrypt(password, b"\0" * SALT_BYTES, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+        return False, None
+    if stored.startswith("scrypt$"):
+        try:
+            _, n, r, p, salt, key = stored.split("$")
+            expected = base64.b64decode(key)
+            actual = _scrypt(password, base64.b64decode(salt), int(n), int(r), int(p))
+        except ValueError:
+            return False, None
+        ok = hmac.compare_digest(actual, expected)
+    else:
+        # Legacy unsalted SHA-256 hex digest. One hash of that is near-instant, so pay for an
+        # scrypt as well: otherwise response time tells legacy accounts apart from unknown ones.
+        _scrypt(password, b"\0" * SALT_BYTES, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+        ok = hmac.compare_digest(hashlib.sha256(password.encode("utf-8")).hexdigest(), stored.lower())
+    if ok and needs_rehash(stored):
+        return True, _hash_password(password)
+    return ok, None
+
+def _run(fn, *args):
+    global _pool
+    if not _slots.acquire(blocking=False):
+        raise AuthBusy()
+    try:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=AUTH_WORKERS, thread_name_prefix="auth")
+        future = _pool.submit(fn, *args)
+    except BaseException:
+        _slots.release()
+        raise
+    # The slot is held until the job finishes, even if this caller stops waiting.
+    future.add_done_callback(lambda _: _slots.release())
+    return future.result(timeout=AUTH_TIMEOUT_SECONDS)
+
+def hash_password(password: str) -> str:
+    """New scrypt hash for `password`, computed on the auth pool."""
+    return _run(_hash_password, password)
+
+def verify_password(password: str, stored: Optional[str]) -> Tuple[bool, Optional[str]]:
+    """(matches, replacement hash or None); a replacement means the stored hash is outdated."""
+    return _run(_verify_password, password, stored)
+
+class LoginThrottle:
+    """Failure counts by (account, client) and by account, with a fixed lockout window."""
+
+    def __init__(self, max_attempts: int = LOGIN_MAX_ATTEMPTS, max_account_attempts: int = LOGIN_MAX_ACCOUNT_ATTEMPTS,
+                 lockout_seconds: int = LOGIN_LOCKOUT_SECONDS, max_entries: int = LOGIN_TABLE_SIZE):
+        self.max_attempts = max_attempts
+        self.max_account_attempts = max_account_attempts
+        self.lockout_seconds = lockout_seconds
+        self.max_entries = max_entries
+        # key -> (failures, first failure time), oldest first.
+        self._failures: "OrderedDict[tuple, Tuple[int, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _keys(self, account: str, client: str):
+        return (("pair", account, client), self.max_attempts), (("account", account), self.max_account_attempts)
+
+    def _live(self, key, now):
+        entry = self._failures.get(key)
+        if entry and now - entry[1] >= self.lockout_seconds:
+            del self._failures[key]
+            return None
+        return entry
+
+    def locked_for(self, account: str, client: str) -> int:
+        """Seconds until this account may be tried again from this client; 0 if not locked."""
+        now = time.monotonic()
+        wait = 0
+        with self._lock:
+            for key, limit in self._keys(account, client):
+                entry = self._live(key, now)
+                if entry and entry[0] >= limit:
+                    wait = max(wait, int(self.lockout_seconds - (now - entry[1])) + 1)
+        return wait
+
+    def failed(self, account: str, client: str):
+        now = time.monotonic()
+        with self._lock:
+            for key, _ in self._keys(account, client):
+                entry = self._live(key, now)
+                self._failures[key] = (entry[0] + 1, entry[1]) if entry else (1, now)
+            while len(self._failures) > self.max_entries:
+                self._failures.popitem(last=False)
+
+    def succeeded(self, account: str, client: str):
+        with self._lock:
+            self._failures.pop(("pair", account, client), None)
+
+class UserDirectory:
+    """users.json in memory, re-read when a stat() at most every check_seconds shows it changed; saves are atomic."""
+
+    def __init__(self, path: str, check_seconds: float = 1.0):
+        self.path = path
+        self.check_seconds = check_seconds
+        self._users: Dict[str, Dict[str, Any]] = {}
+        self._signature = None
+        self._checked = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _signature_of(stat) -> tuple:
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._checked is not None and now - self._checked < self.check_seconds:
+            return
+        self._checked = now
+        try:
+            signature = self._signature_of(os.stat(self.path))
+        except FileNotFoundError:
+            self._users, self._signature = {}, None
+            return
+        if signature == self._signature:
+            return
+        users = {}
+        try:
+            with open(self.path, "r") as f:
+                # Sign what was actually read, in case the file is replaced again meanwhile.
+                signature = self._signature_of(os.fstat(f.fileno()))
+                content = f.read().strip()
+            if content:
+                users = {k.lower(): v for k, v in json.loads(content).items()}
+        except (OSError, ValueError):
+            pass
+        self._users, self._signature = users, signature
+
+    def get(self, email: str):
+        with self._lock:
+            self._refresh()
+            return self._users.get(email.lower())
+
+    def role(self, email: str) -> str:
+        return (self.get(email) or {}).get("role", "user")
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """A copy the caller may edit and hand back to save()."""
+        with self._lock:
+            self._refresh()
+            return {email: dict(record) for email, record in self._users.items()}
+
+    def save(self, users: Dict[str, Dict[str, Any]]):
+        users = {k.lower(): dict(v) for k, v in users.items()}
+        with self._lock:
+            self._write(users)
+
+    def set_hash(self, email: str, new_hash: str, expected: Optional[str] = None) -> bool:
+        """Replace one account's hash against the current file, leaving every other entry as it is.
+
+        With `expected`, only if the stored hash is still that value, so a rehash computed
+        from an old snapshot cannot undo a password reset made in the meantime.
+        """
+        email = email.lower()
+        with self._lock:
+            self._checked = None
+            self._refresh()
+            record = self._users.get(email)
+            if record is None or (expected is not None and record.get("hash") != expected):
+                return False
+            users = {k: dict(v) for k, v in self._users.items()}
+            users[email]["hash"] = new_hash
+            self._write(users)
+            return True
+
+    def _write(self, users: Dict[str, Dict[str, Any]]):
+        # Caller holds self._lock.
+        tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(users, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self._users = users
+        self._signature = self._signature_of(os.stat(self.path))
+        self._checked = time.monotonic()
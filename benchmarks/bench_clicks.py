@@ -0,0 +1,189 @@
+# benchmarks/bench_clicks.py
+"""Server time per task click: full-script rerun vs. action-table fragment rerun.
+
+    python benchmarks/bench_clicks.py [--playbook NAME] [--clicks N] [--out results.json]
+
+Drives app.py through Streamlit's AppTest runner on the largest playbook (by
+task count), with the section holding the most tasks expanded. Each click ticks
+one row checkbox; "full" clicks rerun the whole script, which is what every click
+cost before action tables became fragments, and "fragment" clicks rerun only the
+table holding the checkbox, as the browser does now; a click that moves the
+whole-number progress percentage then reruns the page to redraw the bar, which
+shows up in the fragment p95. The time reported is the script run itself, from
+SCRIPT_STARTED to the matching stop event.
+
+AppTest starts a fresh runner for every run, so fragment reruns are replayed
+through a runner subclass that keeps fragment storage between runs. The app runs
+in a scratch directory with the playbooks symlinked in, so progress.db, the
+audit trail and app.log in the repo are left alone.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("PREWARM_PLAYBOOKS", "0")
+
+# Files the app creates in its working directory (and their rotations or WAL siblings).
+SCRATCH_OWN = ("app.log", "audit.jsonl", "audit.db", "feedback.jsonl")
+
+from streamlit.runtime.fragment import MemoryFragmentStorage  # noqa: E402
+from streamlit.runtime.scriptrunner import ScriptRunnerEvent  # noqa: E402
+from streamlit.runtime.scriptrunner_utils.script_requests import RerunData  # noqa: E402
+from streamlit.testing.v1 import AppTest  # noqa: E402
+from streamlit.testing.v1 import app_test  # noqa: E402
+from streamlit.testing.v1.element_tree import parse_tree_from_messages  # noqa: E402
+from streamlit.testing.v1.local_script_runner import LocalScriptRunner, require_widgets_deltas  # noqa: E402
+
+STOP_EVENTS = {
+    ScriptRunnerEvent.SCRIPT_STOPPED_WITH_SUCCESS,
+    ScriptRunnerEvent.SCRIPT_STOPPED_WITH_COMPILE_ERROR,
+    ScriptRunnerEvent.FRAGMENT_STOPPED_WITH_SUCCESS,
+}
+
+class FragmentRunner(LocalScriptRunner):
+    """LocalScriptRunner with fragment storage shared across runs and a timed script run."""
+
+    storage = MemoryFragmentStorage()
+    fragment_id = None
+    widget_fragments = {}
+    last_run_s = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._fragment_storage = FragmentRunner.storage
+        self._started = None
+
+        def stamp(sender, event, **kwargs):
+            if event == ScriptRunnerEvent.SCRIPT_STARTED:
+                self._started = time.perf_counter()
+            elif event in STOP_EVENTS and self._started is not None:
+                FragmentRunner.last_run_s = time.perf_counter() - self._started
+
+        self.on_event.connect(stamp, weak=False)
+
+    def run(self, widget_state=None, query_params=None, timeout=3, page_hash=""):
+        fragment_id = FragmentRunner.fragment_id
+        self.request_rerun(RerunData(
+            widget_states=widget_state,
+            page_script_hash=page_hash,
+            fragment_id_queue=[fragment_id] if fragment_id else [],
+        ))
+        self.start()
+        require_widgets_deltas(self, timeout)
+        if not fragment_id:
+            FragmentRunner.widget_fragments = {
+                getattr(msg.delta.new_element, msg.delta.new_element.WhichOneof("type")).id: msg.delta.fragment_id
+                for msg in self.forward_msgs()
+                if msg.HasField("delta") and msg.delta.fragment_id and msg.delta.HasField("new_element")
+                and msg.delta.new_element.WhichOneof("type") == "checkbox"
+            }
+        return parse_tree_from_messages(self.forward_msgs())
+
+def scratch_dir(playbook_files):
+    """Working directory with everything symlinked except playbooks/ (docx only) and the files the app writes."""
+    work = tempfile.mkdtemp(prefix="bench_clicks_")
+    for entry in os.listdir(ROOT):
+        if entry not in ("playbooks", ".git") and not entry.startswith(SCRATCH_OWN):
+            os.symlink(os.path.join(ROOT, entry), os.path.join(work, entry))
+    os.mkdir(os.path.join(work, "playbooks"))
+    for name in playbook_files:
+        os.symlink(os.path.join(ROOT, "playbooks", name), os.path.join(work, "playbooks", name))
+    return work
+
+def largest_playbook(names):
+    from playbook_parser import file_digest, load_or_parse
+    from progress_store import TaskIndex
+    counts = {}
+    for name in names:
+        path = os.path.join("playbooks", name)
+        counts[name] = len(TaskIndex(name, load_or_parse(path, file_digest(path))).by_key)
+    return max(counts, key=counts.get), counts
+
+def summarise(samples):
+    ordered = sorted(samples)
+    return {
+        "median_ms": round(statistics.median(ordered) * 1000, 2),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 2),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 2),
+        "samples": len(ordered),
+    }
+
+def run_clicks(args, names):
+    playbook, task_counts = (args.playbook, None) if args.playbook else largest_playbook(names)
+    app_test.LocalScriptRunner = FragmentRunner
+
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=300)
+    at.session_state["authenticated"] = True
+    at.session_state["user"] = {"email": "bench@joval.com", "name": "Bench", "role": "admin"}
+    at.run()
+    at.selectbox(key="select_playbook").set_value(playbook).run()
+
+    # Expand the section with the most task rows.
+    best = None
+    for i in range(len(at.toggle)):
+        at.toggle[i].set_value(True).run()
+        boxes = sum(1 for c in at.checkbox if (c.key or "").startswith("cb_"))
+        if best is None or boxes > best[1]:
+            best = (i, boxes)
+        at.toggle[i].set_value(False).run()
+    at.toggle[best[0]].set_value(True).run()
+    keys = [c.key for c in at.checkbox if (c.key or "").startswith("cb_")]
+    clicks = min(args.clicks, len(keys) // 2)
+
+    full = []
+    for key in keys[:clicks]:
+        at.checkbox(key=key).check().run()
+        full.append(FragmentRunner.last_run_s)
+
+    fragment = []
+    for key in keys[clicks:2 * clicks]:
+        box = at.checkbox(key=key)
+        FragmentRunner.fragment_id = FragmentRunner.widget_fragments[box.id]
+        box.check().run()
+        fragment.append(FragmentRunner.last_run_s)
+        FragmentRunner.fragment_id = None
+        # A fragment run only returns the fragment's elements (and row widget ids change
+        # once saved), so resync the full page, untimed, before the next click.
+        at.run()
+
+    result = {
+        "playbook": playbook,
+        "task_counts": task_counts,
+        "expanded_section_tasks": best[1],
+        "full_rerun": summarise(full),
+        "fragment_rerun": summarise(fragment),
+    }
+    result["speedup"] = round(result["full_rerun"]["median_ms"] / result["fragment_rerun"]["median_ms"], 1)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--playbook", help="playbook file name (default: the one with most tasks)")
+    parser.add_argument("--clicks", type=int, default=10)
+    parser.add_argument("--out", help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    names = sorted(f for f in os.listdir(os.path.join(ROOT, "playbooks")) if f.lower().endswith(".docx"))
+    work = scratch_dir(names)
+    os.chdir(work)
+    try:
+        result = run_clicks(args, names)
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(work, ignore_errors=True)
+    text = json.dumps(result, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            fh.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# benchmarks/bench_logins.py
+"""Latency of N concurrent logins through the auth pool, and what they do to the server.
+
+    python benchmarks/bench_logins.py [--logins N] [--concurrency C] [--out results.json]
+
+Each simulated session verifies a password against a stored scrypt hash from its
+own thread, as Streamlit script threads do, mixing correct and wrong passwords.
+Meanwhile a heartbeat thread stands in for the server's event loop: it asks to
+wake every 5 ms and records how late it actually woke, which shows whether the
+KDF work (run with the GIL released, at most AUTH_WORKERS at a time) starves
+other threads. Logins refused because the pool queue was full are counted.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import auth  # noqa: E402
+
+HEARTBEAT_S = 0.005
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+def summarise_ms(samples):
+    ordered = sorted(samples)
+    if not ordered:
+        return {"samples": 0}
+    return {
+        "p50_ms": round(statistics.median(ordered) * 1000, 2),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+        "samples": len(ordered),
+    }
+
+def heartbeat(stop, lags):
+    while not stop.is_set():
+        start = time.perf_counter()
+        time.sleep(HEARTBEAT_S)
+        lags.append(time.perf_counter() - start - HEARTBEAT_S)
+
+def run(logins, concurrency):
+    stored = auth.hash_password("correct horse")
+    latencies, busy, results = [], 0, {"ok": 0, "failed": 0}
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal busy
+        start = time.perf_counter()
+        try:
+            ok, _ = auth.verify_password("correct horse" if i % 2 else "wrong", stored)
+        except auth.AuthBusy:
+            with lock:
+                busy += 1
+            return
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            results["ok" if ok else "failed"] += 1
+
+    stop, lags = threading.Event(), []
+    beat = threading.Thread(target=heartbeat, args=(stop, lags), daemon=True)
+    beat.start()
+    time.sleep(0.2)
+    idle_lags = len(lags)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as sessions:
+        list(sessions.map(one, range(logins)))
+    wall = time.perf_counter() - start
+    stop.set()
+    beat.join()
+
+    return {
+        "logins": logins,
+        "concurrency": concurrency,
+        "auth_workers": auth.AUTH_WORKERS,
+        "auth_queue": auth.AUTH_QUEUE,
+        "scrypt": {"n": auth.SCRYPT_N, "r": auth.SCRYPT_R, "p": auth.SCRYPT_P},
+        "wall_s": round(wall, 3),
+        "logins_per_s": round(len(latencies) / wall, 1),
+        "refused_busy": busy,
+        "results": results,
+        "login_latency": summarise_ms(latencies),
+        "heartbeat_lag_idle": summarise_ms(lags[:idle_lags]),
+        "heartbeat_lag_under_load": summarise_ms(lags[idle_lags:]),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32, help="simultaneous sessions logging in")
+    parser.add_argument("--out", help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    text = json.dumps(run(args.logins, args.concurrency), indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            fh.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# benchmarks/bench_parsers.py
+"""Compare the mammoth and direct-OOXML parse paths on the bundled playbooks.
+
+    python benchmarks/bench_parsers.py [--repeat N] [--out results.json]
+
+Times parse_playbook in each mode (best of N, parse cache bypassed, with the
+per-stage split from parse_playbook's timings) and checks that both modes
+agree on section paths and table shapes, which is what task keys are
+derived from.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import playbook_parser  # noqa: E402
+
+def table_shapes(sections, path=()):
+    shapes = []
+    for sec in sections:
+        sec_path = path + (sec["title"],)
+        shapes.append((sec_path, tuple(len(item["value"]) for item in sec["content"] if item["type"] == "table")))
+        shapes.extend(table_shapes(sec["subs"], sec_path))
+    return shapes
+
+def best_of(repeat, path, mode):
+    """Best wall time over `repeat` parses, with the per-stage split of that run."""
+    best, result, stages = None, None, None
+    for _ in range(repeat):
+        timings = {}
+        start = time.perf_counter()
+        result = playbook_parser.parse_playbook(path, mode, timings=timings)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best, stages = elapsed, timings
+    return best, result, {stage: round(seconds, 5) for stage, seconds in stages.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    paths = sorted(os.path.join("playbooks", f) for f in os.listdir("playbooks") if f.lower().endswith(".docx"))
+    results = []
+    for path in paths:
+        mammoth_s, mammoth_tree, mammoth_stages = best_of(args.repeat, path, "mammoth")
+        ooxml_s, ooxml_tree, ooxml_stages = best_of(args.repeat, path, "ooxml")
+        results.append({
+            "playbook": os.path.basename(path),
+            "bytes": os.path.getsize(path),
+            "mammoth_s": round(mammoth_s, 4),
+            "ooxml_s": round(ooxml_s, 4),
+            "speedup": round(mammoth_s / ooxml_s, 2),
+            "mammoth_stages": mammoth_stages,
+            "ooxml_stages": ooxml_stages,
+            "same_structure": table_shapes(mammoth_tree) == table_shapes(ooxml_tree),
+            "identical": mammoth_tree == ooxml_tree,
+        })
+    summary = {
+        "lxml": playbook_parser.LXML_AVAILABLE,
+        "repeat": args.repeat,
+        "mammoth_total_s": round(sum(r["mammoth_s"] for r in results), 4),
+        "ooxml_total_s": round(sum(r["ooxml_s"] for r in results), 4),
+        "playbooks": results,
+    }
+    text = json.dumps(summary, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            fh.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+# benchmarks/bench_suite.py
+"""Headless benchmark suite for the parse, render, save and export hot paths.
+
+    python benchmarks/bench_suite.py [--only parse,rerun,save,export] [--repeat N]
+                                     [--reruns N] [--out results.json] [--compare baseline.json]
+
+Runs against every .docx in playbooks/ and writes one JSON document:
+
+  parse   per playbook: a fresh parse_playbook (best of N, with tracemalloc peak),
+          a load from the on-disk parse cache, and a warm PlaybookRegistry hit
+  rerun   per playbook: server time of a full main() rerun through AppTest, with the
+          playbook selected and sections in their default (collapsed) state
+  save    ProgressCache.write latency for single-task writes, and one write of every task
+  export  export_to_excel for one playbook and with bulk_export, plus CSV, with
+          wall time, tracemalloc peak and output size
+
+Everything runs in a scratch directory with the playbooks symlinked in (see
+bench_clicks.scratch_dir), seeded with half the tasks of each playbook complete,
+so progress.db and the audit files in the repo are left alone. The git commit
+is recorded, and --compare reports the ratio of every timing and memory figure
+against an earlier results file; ratios above --threshold are listed as
+regressions.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_clicks import ROOT, FragmentRunner, scratch_dir, summarise  # noqa: E402
+from playbook_parser import PARSER_MODE  # noqa: E402
+
+SECTIONS = ("parse", "rerun", "save", "export")
+PLAYBOOKS_DIR = "playbooks"
+METRIC_SUFFIXES = ("_ms", "_s", "_mb")
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def traced(fn, *args, **kwargs):
+    """(result, seconds, peak MB allocated by Python while fn ran)."""
+    tracemalloc.start()
+    try:
+        result, seconds = timed(fn, *args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, seconds, round(peak / 2 ** 20, 2)
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def bench_parse(registry, names, repeat):
+    from playbook_parser import file_digest, load_parse_cache, parse_playbook
+    results = {}
+    for name in names:
+        path = os.path.join(PLAYBOOKS_DIR, name)
+        best, peak = None, None
+        for _ in range(repeat):
+            _, seconds, mb = traced(parse_playbook, path)
+            if best is None or seconds < best:
+                best, peak = seconds, mb
+        digest = file_digest(path)
+        _, disk_s = timed(load_parse_cache, digest)
+        registry.get(path)
+        _, warm_s = timed(registry.get, path)
+        results[name] = {
+            "bytes": os.path.getsize(path),
+            "tasks": len(registry.task_index(path).by_key),
+            "fresh_parse_s": round(best, 4),
+            "fresh_parse_peak_mb": peak,
+            "disk_cache_ms": round(disk_s * 1000, 3),
+            "registry_hit_ms": round(warm_s * 1000, 4),
+        }
+    return results
+
+def seed_progress(registry, cache, names):
+    """Half of every playbook's tasks complete, every fourth with a comment."""
+    for name in names:
+        index = registry.task_index(os.path.join(PLAYBOOKS_DIR, name))
+        completed = {key: True for key in index.keys[::2]}
+        comments = {f"{key}::comment": f"Note on {key[-12:]}" for key in index.keys[::4]}
+        cache.write(name, completed, comments, {})
+
+def bench_rerun(names, reruns):
+    from streamlit.testing.v1 import AppTest, app_test
+    app_test.LocalScriptRunner = FragmentRunner
+    FragmentRunner.fragment_id = None
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=300)
+    at.session_state["authenticated"] = True
+    at.session_state["user"] = {"email": "bench@joval.com", "name": "Bench", "role": "admin"}
+    at.run()
+    results = {}
+    for name in names:
+        at.selectbox(key="select_playbook").set_value(name).run()
+        samples = []
+        for _ in range(reruns):
+            at.run()
+            samples.append(FragmentRunner.last_run_s)
+        if at.exception:
+            raise RuntimeError(f"{name}: {at.exception[0].value}")
+        results[name] = summarise(samples)
+    return results
+
+def bench_save(registry, cache, names, writes):
+    name = max(names, key=lambda n: len(registry.task_index(os.path.join(PLAYBOOKS_DIR, n)).keys))
+    keys = registry.task_index(os.path.join(PLAYBOOKS_DIR, name)).keys
+    single = []
+    for i in range(writes):
+        key = keys[i % len(keys)]
+        _, seconds = timed(cache.write, name, {key: bool(i % 2)}, {}, {})
+        single.append(seconds)
+    _, all_s = timed(cache.write, name, {key: True for key in keys}, {}, {})
+    return {
+        "playbook": name,
+        "single_task": summarise(single),
+        "all_tasks": {"tasks": len(keys), "wall_ms": round(all_s * 1000, 2)},
+    }
+
+def bench_export(names):
+    # Exports are built by the app itself; importing it runs the script headless.
+    import app
+    app.playbooks = names
+    name = names[0]
+    results = {}
+    for label, fn, args in (
+        ("excel", app.export_to_excel, (name, False)),
+        ("excel_bulk", app.export_to_excel, (name, True)),
+        ("csv", app.export_to_csv, (name,)),
+    ):
+        data, seconds, mb = traced(fn, *args)
+        results[label] = {"wall_ms": round(seconds * 1000, 2), "peak_mb": mb, "bytes": len(data)}
+    results["playbook"] = name
+    return results
+
+def flatten(tree, prefix=""):
+    for key, value in tree.items():
+        path = f"{prefix}/{key}" if prefix else key
+        if isinstance(value, dict):
+            yield from flatten(value, path)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and key.endswith(METRIC_SUFFIXES):
+            yield path, value
+
+def compare(current, baseline, threshold):
+    old = dict(flatten(baseline.get("results", {})))
+    ratios = {}
+    for path, value in flatten(current["results"]):
+        if old.get(path):
+            ratios[path] = round(value / old[path], 3)
+    return {
+        "baseline_commit": baseline.get("commit"),
+        "threshold": threshold,
+        "regressions": {path: r for path, r in ratios.items() if r > threshold},
+        "ratios": ratios,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", default=",".join(SECTIONS), help="comma-separated subset of " + ", ".join(SECTIONS))
+    parser.add_argument("--repeat", type=int, default=3, help="fresh parses per playbook (best is kept)")
+    parser.add_argument("--reruns", type=int, default=5, help="timed main() reruns per playbook")
+    parser.add_argument("--writes", type=int, default=200, help="single-task progress writes")
+    parser.add_argument("--out", help="write JSON results here instead of stdout")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=1.10, help="ratio above which a figure counts as a regression")
+    args = parser.parse_args()
+    only = [s.strip() for s in args.only.split(",") if s.strip()]
+    unknown = set(only) - set(SECTIONS)
+    if unknown:
+        parser.error(f"unknown sections: {', '.join(sorted(unknown))}")
+
+    names = sorted(f for f in os.listdir(os.path.join(ROOT, "playbooks")) if f.lower().endswith(".docx"))
+    work = scratch_dir(names)
+    os.chdir(work)
+    try:
+        from playbook_registry import PlaybookRegistry
+        from progress_store import ProgressCache, ProgressStore
+        registry = PlaybookRegistry(1 << 30)
+        cache = ProgressCache(ProgressStore(os.path.join(PLAYBOOKS_DIR, "progress.db"), PLAYBOOKS_DIR))
+        results = {}
+        # Parsing also fills the registry the other sections use.
+        parsed = bench_parse(registry, names, args.repeat) if "parse" in only else None
+        if parsed is not None:
+            results["parse"] = parsed
+        else:
+            for name in names:
+                registry.get(os.path.join(PLAYBOOKS_DIR, name))
+        seed_progress(registry, cache, names)
+        if "save" in only:
+            results["save"] = bench_save(registry, cache, names, args.writes)
+        if "export" in only:
+            results["export"] = bench_export(names)
+        if "rerun" in only:
+            results["rerun"] = bench_rerun(names, args.reruns)
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(work, ignore_errors=True)
+
+    document = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "parser_mode": PARSER_MODE,
+        "playbooks": len(names),
+        "results": results,
+    }
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as fh:
+            document["compare"] = compare(document, json.load(fh), args.threshold)
+    text = json.dumps(document, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            fh.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
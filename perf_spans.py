@@ -0,0 +1,179 @@
+# perf_spans.py
+"""Named timing spans for the app's hot paths, with rolling percentiles.
+
+    with span("progress_load"):
+        ...
+
+    @span("parse")
+    def parse(...):
+        ...
+
+Every span keeps its last SPAN_WINDOW durations in memory (for p50/p95) plus a
+running count and sum, process-wide. Recording is a perf_counter pair and a
+deque append under a lock, so spans can stay on in production.
+
+Two exports, both optional and written by one background thread every
+SPANS_EXPORT_SECONDS:
+
+  SPANS_PROMETHEUS_FILE  Prometheus text format, rewritten atomically. Under
+                         static/ it is served by Streamlit's static file
+                         handler, e.g. /app/static/metrics/spans.txt.
+  SPANS_JSONL_FILE       every sample as one JSON object per line, appended.
+"""
+import os
+import json
+import time
+import atexit
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+SPAN_WINDOW = int(os.environ.get("SPAN_WINDOW", "500"))
+SPANS_PROMETHEUS_FILE = os.environ.get("SPANS_PROMETHEUS_FILE", "")
+SPANS_JSONL_FILE = os.environ.get("SPANS_JSONL_FILE", "")
+SPANS_EXPORT_SECONDS = float(os.environ.get("SPANS_EXPORT_SECONDS", "15"))
+# Samples waiting for the JSON-lines export; the oldest are dropped if the writer falls behind.
+SPANS_PENDING_MAX = 100000
+METRIC_NAME = "playbook_span_seconds"
+
+def _percentile(ordered: List[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+class SpanRecorder:
+    """Rolling window of durations per span name, plus lifetime count and sum."""
+
+    def __init__(self, window: int = SPAN_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._windows: Dict[str, deque] = {}
+        self._totals: Dict[str, List[float]] = {}
+        self._pending: Optional[deque] = None
+
+    def keep_pending(self):
+        """Start queueing every sample for the JSON-lines export."""
+        with self._lock:
+            if self._pending is None:
+                self._pending = deque(maxlen=SPANS_PENDING_MAX)
+
+    def record(self, name: str, seconds: float):
+        sample = (time.time(), seconds)
+        with self._lock:
+            window = self._windows.get(name)
+            if window is None:
+                window = self._windows[name] = deque(maxlen=self.window)
+                self._totals[name] = [0, 0.0]
+            window.append(sample)
+            totals = self._totals[name]
+            totals[0] += 1
+            totals[1] += seconds
+            if self._pending is not None:
+                self._pending.append((name,) + sample)
+
+    def reset(self):
+        with self._lock:
+            self._windows.clear()
+            self._totals.clear()
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Per span: lifetime count and sum, and p50/p95/max/last over the rolling window."""
+        with self._lock:
+            windows = {name: [s for _, s in window] for name, window in self._windows.items()}
+            totals = {name: tuple(t) for name, t in self._totals.items()}
+        stats = {}
+        for name in sorted(windows):
+            durations = windows[name]
+            ordered = sorted(durations)
+            stats[name] = {
+                "count": int(totals[name][0]),
+                "sum_s": totals[name][1],
+                "window": len(ordered),
+                "p50_ms": _percentile(ordered, 0.5) * 1000,
+                "p95_ms": _percentile(ordered, 0.95) * 1000,
+                "max_ms": ordered[-1] * 1000,
+                "last_ms": durations[-1] * 1000,
+            }
+        return stats
+
+    def samples(self) -> List[Dict[str, Any]]:
+        """Every sample still in a window, oldest first."""
+        with self._lock:
+            rows = [(ts, name, s) for name, window in self._windows.items() for ts, s in window]
+        return [_sample_entry(name, ts, s) for ts, name, s in sorted(rows)]
+
+    def drain_pending(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            if not self._pending:
+                return []
+            pending, self._pending = self._pending, deque(maxlen=SPANS_PENDING_MAX)
+        return [_sample_entry(name, ts, s) for name, ts, s in pending]
+
+    def prometheus_text(self) -> str:
+        """Summary metric in Prometheus text exposition format (quantiles over the rolling window)."""
+        lines = [f"# HELP {METRIC_NAME} Duration of named app spans.", f"# TYPE {METRIC_NAME} summary"]
+        for name, stats in self.snapshot().items():
+            label = name.replace("\\", "\\\\").replace('"', '\\"')
+            lines.append(f'{METRIC_NAME}{{span="{label}",quantile="0.5"}} {stats["p50_ms"] / 1000:.6f}')
+            lines.append(f'{METRIC_NAME}{{span="{label}",quantile="0.95"}} {stats["p95_ms"] / 1000:.6f}')
+            lines.append(f'{METRIC_NAME}_sum{{span="{label}"}} {stats["sum_s"]:.6f}')
+            lines.append(f'{METRIC_NAME}_count{{span="{label}"}} {stats["count"]}')
+        return "\n".join(lines) + "\n"
+
+def _sample_entry(name: str, ts: float, seconds: float) -> Dict[str, Any]:
+    return {"ts": datetime.fromtimestamp(ts).isoformat(timespec="milliseconds"), "span": name,
+            "ms": round(seconds * 1000, 3)}
+
+def samples_jsonl(samples: List[Dict[str, Any]]) -> str:
+    return "".join(json.dumps(sample) + "\n" for sample in samples)
+
+recorder = SpanRecorder()
+
+@contextmanager
+def span(name: str):
+    """Time the enclosed block (or decorated function) under `name`, even if it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        recorder.record(name, time.perf_counter() - start)
+
+def export_spans():
+    """Write the configured exports once."""
+    if SPANS_PROMETHEUS_FILE:
+        os.makedirs(os.path.dirname(SPANS_PROMETHEUS_FILE) or ".", exist_ok=True)
+        tmp = f"{SPANS_PROMETHEUS_FILE}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            fh.write(recorder.prometheus_text())
+        os.replace(tmp, SPANS_PROMETHEUS_FILE)
+    if SPANS_JSONL_FILE:
+        samples = recorder.drain_pending()
+        if samples:
+            with open(SPANS_JSONL_FILE, "a", encoding="utf-8") as fh:
+                fh.write(samples_jsonl(samples))
+
+_exporter: Optional[threading.Thread] = None
+_exporter_lock = threading.Lock()
+_stop = threading.Event()
+
+def _export_loop():
+    while not _stop.wait(SPANS_EXPORT_SECONDS):
+        try:
+            export_spans()
+        except OSError:
+            pass
+
+def start_span_export() -> Optional[threading.Thread]:
+    """Start the export thread once per process, if any export is configured."""
+    global _exporter
+    if not (SPANS_PROMETHEUS_FILE or SPANS_JSONL_FILE):
+        return None
+    with _exporter_lock:
+        if _exporter is None:
+            if SPANS_JSONL_FILE:
+                recorder.keep_pending()
+            _exporter = threading.Thread(target=_export_loop, name="span-export", daemon=True)
+            _exporter.start()
+            # Final write on interpreter exit.
+            atexit.register(lambda: (_stop.set(), export_spans()))
+    return _exporter
@@ -0,0 +1,689 @@
+# playbook_parser.py
+"""Playbook .docx parsing and the on-disk parse cache.
+
+Kept free of Streamlit so worker processes can import it to pre-warm the cache.
+"""
+import os
+import re
+import sys
+import json
+import hashlib
+import logging
+import time
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+from html.parser import HTMLParser
+from pathlib import Path
+from typing import List, Dict, Any
+
+import mammoth
+from bs4 import BeautifulSoup
+
+try:
+    from lxml import etree
+    LXML_AVAILABLE = True
+except ImportError:
+    LXML_AVAILABLE = False
+
+ref_pattern = re.compile(r'^\d+(\.\d+)*\b')
+
+CACHE_DIR = ".cache"
+PARSE_CACHE_DIR = os.path.join(CACHE_DIR, "parsed")
+# Bump whenever parse_playbook output changes shape so stale cache entries are ignored.
+PARSER_VERSION = "3"
+# "mammoth": .docx -> HTML -> sections; "ooxml": read word/document.xml directly (build_sections_ooxml).
+PARSER_MODE = os.environ.get("PLAYBOOK_PARSER", "mammoth")
+# Images extracted from playbooks, served by Streamlit static serving (.streamlit/config.toml).
+ASSETS_DIR = os.path.join("static", "playbook_assets")
+ASSETS_URL = "app/static/playbook_assets"
+IMAGE_EXTENSIONS = {
+    "image/png": ".png", "image/jpeg": ".jpg", "image/gif": ".gif", "image/webp": ".webp",
+    "image/bmp": ".bmp", "image/tiff": ".tiff", "image/x-emf": ".emf", "image/x-wmf": ".wmf",
+}
+Path(PARSE_CACHE_DIR).mkdir(parents=True, exist_ok=True)
+Path(ASSETS_DIR).mkdir(parents=True, exist_ok=True)
+
+_digest_memo: Dict[str, tuple] = {}
+
+def file_digest(path: str) -> str:
+    """SHA-256 of a file, memoised on (mtime, size) so unchanged files are not re-read."""
+    info = os.stat(path)
+    stamp = (info.st_mtime_ns, info.st_size)
+    memo = _digest_memo.get(path)
+    if memo and memo[0] == stamp:
+        return memo[1]
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    _digest_memo[path] = (stamp, digest)
+    return digest
+
+def parse_cache_path(digest: str) -> str:
+    return os.path.join(PARSE_CACHE_DIR, f"{digest}_{PARSER_MODE}_v{PARSER_VERSION}.json")
+
+def load_parse_cache(digest: str):
+    path = parse_cache_path(digest)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, json.JSONDecodeError, ValueError):
+        return None
+
+def store_parse_cache(digest: str, sections: List[Dict[str, Any]]):
+    path = parse_cache_path(digest)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(sections, fh)
+        os.replace(tmp, path)
+        for stale in Path(PARSE_CACHE_DIR).glob(f"{digest}_{PARSER_MODE}_v*.json"):
+            if str(stale) != path:
+                stale.unlink(missing_ok=True)
+    except OSError as e:
+        logging.warning(f"Could not write parse cache for {digest}: {e}")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def store_asset(data: bytes, content_type: str) -> str:
+    """Write an image once under its content hash and return the URL it is served from."""
+    ext = IMAGE_EXTENSIONS.get(content_type, ".bin")
+    name = hashlib.sha256(data).hexdigest() + ext
+    path = os.path.join(ASSETS_DIR, name)
+    if not os.path.exists(path):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+    return f"{ASSETS_URL}/{name}"
+
+def store_image_asset(image) -> Dict[str, str]:
+    """mammoth image converter: store the image and reference it by URL instead of a data: URI."""
+    with image.open() as fh:
+        return {"src": store_asset(fh.read(), image.content_type)}
+
+def missing_assets(sections: List[Dict[str, Any]]) -> bool:
+    for sec in sections:
+        for item in sec.get("content", []):
+            if item["type"] == "image" and item["value"].startswith(ASSETS_URL):
+                name = item["value"][len(ASSETS_URL) + 1:]
+                if not os.path.exists(os.path.join(ASSETS_DIR, name)):
+                    return True
+        if missing_assets(sec.get("subs", [])):
+            return True
+    return False
+
+def load_or_parse(path: str, digest: str) -> List[Dict[str, Any]]:
+    sections = load_parse_cache(digest)
+    if sections is None or missing_assets(sections):
+        sections = parse_playbook(path)
+        store_parse_cache(digest, sections)
+    return sections
+
+def prewarm(path: str) -> Dict[str, Any]:
+    """Pre-warm entry point (python playbook_parser.py --prewarm PATH): make sure the parse cache holds `path`.
+
+    Only a small summary goes back to the parent; it reads the sections from the cache.
+    """
+    start = time.perf_counter()
+    digest = file_digest(path)
+    sections = load_parse_cache(digest)
+    parsed = sections is None or missing_assets(sections)
+    timings: Dict[str, float] = {}
+    if parsed:
+        store_parse_cache(digest, parse_playbook(path, timings=timings))
+    return {"path": path, "digest": digest, "parsed": parsed, "seconds": time.perf_counter() - start, "stages": timings}
+
+EXCLUDE_TERMS = ["table of contents", "document control", "document revision", "assumptions", "disclaimer"]
+
+def excluded(text: str) -> bool:
+    if not text:
+        return False
+    tl = text.strip().lower()
+    return any(ex in tl for ex in EXCLUDE_TERMS)
+
+def attach_heading(sections: List[Dict[str, Any]], stack: List[Dict[str, Any]], title: str, level: int):
+    node = {"title": title, "level": level, "content": [], "subs": []}
+    while stack and stack[-1]["level"] >= level:
+        stack.pop()
+    if stack:
+        stack[-1]["subs"].append(node)
+    else:
+        sections.append(node)
+    stack.append(node)
+
+def build_sections_bs4(html: str) -> List[Dict[str, Any]]:
+    """Reference builder: full BeautifulSoup DOM walk. Kept to verify SectionBuilder against."""
+    soup = BeautifulSoup(html, "html.parser")
+    sections = []
+    stack = []
+
+    for tag in soup.find_all(['h1','h2','h3','h4','p','table','img']):
+        if tag.name.startswith('h') and tag.name[1:].isdigit():
+            title = tag.get_text().strip()
+            if excluded(title):
+                continue
+            attach_heading(sections, stack, title, int(tag.name[1]))
+        elif tag.name == 'p':
+            text = tag.get_text(separator="\n").strip()
+            if text and stack:
+                stack[-1]["content"].append({"type": "text", "value": text})
+        elif tag.name == 'img':
+            src = tag.get("src", "")
+            if src and stack:
+                stack[-1]["content"].append({"type": "image", "value": src})
+        elif tag.name == 'table':
+            rows = [[td.get_text(separator="\n").strip() for td in tr.find_all(["td","th"])] for tr in tag.find_all("tr")]
+            if rows and stack:
+                stack[-1]["content"].append({"type": "table", "value": rows})
+    return sections
+
+HEADING_TAGS = {"h1", "h2", "h3", "h4"}
+# BeautifulSoup collapses strings made only of these characters to a single "\n" or " ".
+_ASCII_SPACES = str.maketrans("", "", "\x20\x0a\x09\x0c\x0d")
+
+class SectionBuilder:
+    """Single-pass section builder driven by start/end/data events (the lxml parser-target interface).
+
+    Produces exactly what build_sections_bs4 does for mammoth's HTML without
+    materialising a DOM. BeautifulSoup visits elements in start-tag order but reads
+    their text from descendants, so paragraphs and tables reserve their slot when
+    they open and are filled (or dropped, if empty) when they close; items inside a
+    heading are held back until its title decides whether the heading is kept.
+    """
+
+    def __init__(self):
+        self.sections: List[Dict[str, Any]] = []
+        self.stack: List[Dict[str, Any]] = []
+        self._chunks: List[str] = []
+        self._open: List[tuple] = []
+        self._collectors: List[List[str]] = []
+        self._held = None
+        self._rows = None
+        self._row = None
+
+    def _target(self):
+        if self._held is not None:
+            return self._held
+        return self.stack[-1]["content"] if self.stack else None
+
+    def _flush(self):
+        # Adjacent data events form one string, as in BeautifulSoup.
+        if not self._chunks:
+            return
+        text = "".join(self._chunks)
+        self._chunks = []
+        if not text.translate(_ASCII_SPACES):
+            text = "\n" if "\n" in text else " "
+        for strings in self._collectors:
+            strings.append(text)
+
+    def start(self, tag, attrs):
+        self._flush()
+        if tag == "p":
+            item = {"type": "text", "value": None}
+            target = self._target()
+            if target is not None:
+                target.append(item)
+            strings = []
+            self._collectors.append(strings)
+            self._open.append((tag, item, strings))
+        elif tag in ("td", "th"):
+            strings = []
+            self._collectors.append(strings)
+            self._open.append((tag, None, strings))
+        elif tag == "tr":
+            if self._rows is not None:
+                self._row = []
+                self._rows.append(self._row)
+        elif tag == "table":
+            item = {"type": "table", "value": None}
+            target = self._target()
+            if target is not None:
+                target.append(item)
+            self._rows = []
+            self._open.append((tag, item, self._rows))
+        elif tag in HEADING_TAGS and self._held is None:
+            strings = []
+            self._collectors.append(strings)
+            self._held = []
+            self._open.append((tag, None, strings))
+        elif tag == "img":
+            src = dict(attrs).get("src", "")
+            target = self._target()
+            if src and target is not None:
+                target.append({"type": "image", "value": src})
+
+    def end(self, tag):
+        self._flush()
+        if tag == "tr":
+            self._row = None
+            return
+        for i in range(len(self._open) - 1, -1, -1):
+            if self._open[i][0] == tag:
+                break
+        else:
+            return
+        while len(self._open) > i:
+            self._close(*self._open.pop())
+
+    def _close(self, tag, item, payload):
+        if tag == "table":
+            item["value"] = payload or None
+            self._rows = None
+            return
+        # Collectors open and close in the same order as self._open.
+        self._collectors.pop()
+        if tag == "p":
+            item["value"] = "\n".join(payload).strip() or None
+        elif tag in ("td", "th"):
+            if self._row is not None:
+                self._row.append("\n".join(payload).strip())
+        else:
+            title = "".join(payload).strip()
+            held, self._held = self._held, None
+            if not excluded(title):
+                attach_heading(self.sections, self.stack, title, int(tag[1]))
+            target = self._target()
+            if target is not None:
+                target.extend(held)
+
+    def data(self, text):
+        self._chunks.append(text)
+
+    def close(self) -> List[Dict[str, Any]]:
+        self._flush()
+        while self._open:
+            self._close(*self._open.pop())
+
+        def drop_empty(nodes):
+            for node in nodes:
+                node["content"] = [item for item in node["content"] if item["value"] is not None]
+                drop_empty(node["subs"])
+        drop_empty(self.sections)
+        return self.sections
+
+class _HTMLEventParser(HTMLParser):
+    """Feeds stdlib html.parser events into a SectionBuilder when lxml is unavailable."""
+
+    def __init__(self, target: SectionBuilder):
+        super().__init__(convert_charrefs=True)
+        self.target = target
+
+    def handle_starttag(self, tag, attrs):
+        self.target.start(tag, attrs)
+
+    def handle_endtag(self, tag):
+        self.target.end(tag)
+
+    def handle_data(self, data):
+        self.target.data(data)
+
+def build_sections(html: str) -> List[Dict[str, Any]]:
+    builder = SectionBuilder()
+    if LXML_AVAILABLE:
+        parser = etree.HTMLParser(target=builder)
+        parser.feed(html)
+        return parser.close()
+    parser = _HTMLEventParser(builder)
+    parser.feed(html)
+    parser.close()
+    return builder.close()
+
+def verify_section_builder(paths: List[str]) -> Dict[str, bool]:
+    """True per playbook when SectionBuilder matches the BeautifulSoup reference exactly."""
+    results = {}
+    for path in paths:
+        with open(path, "rb") as fh:
+            html = mammoth.convert_to_html(fh, convert_image=mammoth.images.img_element(store_image_asset)).value
+        results[os.path.basename(path)] = build_sections(html) == build_sections_bs4(html)
+    return results
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_R = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_A = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+_V = "{urn:schemas-microsoft-com:vml}"
+_WP = "{http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing}"
+_MC = "{http://schemas.openxmlformats.org/markup-compatibility/2006}"
+_PKG_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_EXTENSION_TYPES = {ext: ctype for ctype, ext in IMAGE_EXTENSIONS.items()}
+_EXTENSION_TYPES[".jpeg"] = "image/jpeg"
+# Elements whose children mammoth reads; anything else (w:del, w:instrText, ...) is skipped.
+_OOXML_CONTAINERS = {
+    _W + "r", _W + "hyperlink", _W + "ins", _W + "smartTag", _W + "object", _W + "drawing",
+    _W + "pict", _W + "sdt", _W + "sdtContent", _W + "p",
+    _V + "group", _V + "rect", _V + "roundrect", _V + "shape", _V + "textbox",
+}
+
+def _ooxml_styles(zf: zipfile.ZipFile):
+    """Heading level per paragraph style id (mammoth's default style map) and styles that imply a list."""
+    headings, listed = {}, set()
+    if "word/styles.xml" in zf.namelist():
+        for style in ET.fromstring(zf.read("word/styles.xml")).iter(_W + "style"):
+            style_id = style.get(_W + "styleId")
+            name = style.find(_W + "name")
+            name = name.get(_W + "val", "").lower() if name is not None else ""
+            match = re.fullmatch(r"heading ([1-6])", name) or re.fullmatch(r"Heading([1-6])", style_id or "")
+            if match:
+                headings[style_id] = int(match.group(1))
+    num_ids = set()
+    if "word/numbering.xml" in zf.namelist():
+        numbering = ET.fromstring(zf.read("word/numbering.xml"))
+        num_ids = {num.get(_W + "numId") for num in numbering.iter(_W + "num")}
+        for pstyle in numbering.iter(_W + "pStyle"):
+            listed.add(pstyle.get(_W + "val"))
+    return headings, listed, num_ids
+
+def _ooxml_relationships(zf: zipfile.ZipFile) -> Dict[str, str]:
+    rels = {}
+    if "word/_rels/document.xml.rels" in zf.namelist():
+        for rel in ET.fromstring(zf.read("word/_rels/document.xml.rels")).iter(_PKG_REL + "Relationship"):
+            if rel.get("TargetMode") != "External":
+                target = rel.get("Target", "")
+                rels[rel.get("Id")] = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join("word", target))
+    return rels
+
+def build_sections_ooxml(path: str) -> List[Dict[str, Any]]:
+    """Read word/document.xml straight from the .docx into the same tree build_sections returns.
+
+    Mirrors what mammoth would emit for the HTML walk: heading 1-4 styles open sections,
+    list paragraphs contribute only their images, table cells keep mammoth's vMerge
+    handling, and cell paragraphs are repeated as text after their table. Text-box
+    paragraphs follow their anchoring paragraph as paragraphs of their own. Footnote
+    references become " [n] " in reference order, and the referenced footnotes are
+    added to the last section as "<text> ↑", as mammoth's notes list is. Endnotes and
+    comments are not read. Run formatting is not split into separate strings, so
+    spacing around footnote markers and formatted runs can differ from mammoth's.
+    """
+    sections: List[Dict[str, Any]] = []
+    stack: List[Dict[str, Any]] = []
+
+    with zipfile.ZipFile(path) as zf:
+        heading_styles, list_styles, num_ids = _ooxml_styles(zf)
+        rels = _ooxml_relationships(zf)
+        image_urls: Dict[str, str] = {}
+        footnote_refs: List[str] = []
+
+        def image_url(rel_id):
+            target = rels.get(rel_id)
+            if target is None or target not in zf.namelist():
+                return None
+            if target not in image_urls:
+                ctype = _EXTENSION_TYPES.get(posixpath.splitext(target)[1].lower(), "application/octet-stream")
+                image_urls[target] = store_asset(zf.read(target), ctype)
+            return image_urls[target]
+
+        def read_runs(el, pieces, images, state):
+            for child in el:
+                tag = child.tag
+                if tag == _W + "t":
+                    pieces.append(child.text or "")
+                elif tag == _W + "tab":
+                    pieces.append("\t")
+                elif tag == _W + "noBreakHyphen":
+                    pieces.append("\u2011")
+                elif tag in (_W + "br", _W + "cr"):
+                    if child.get(_W + "type") in (None, "textWrapping"):
+                        pieces.append(None)
+                elif tag == _W + "bookmarkStart":
+                    state["anchor"] = state["anchor"] or child.get(_W + "name") != "_GoBack"
+                elif tag == _W + "footnoteReference":
+                    footnote_refs.append(child.get(_W + "id"))
+                    pieces.append(f" [{len(footnote_refs)}] ")
+                elif tag == _W + "txbxContent":
+                    # Each text-box paragraph is a paragraph of its own, not more runs of this one.
+                    state["nested"].extend(read_paragraph(p) for p in child.iter(_W + "p")
+                                           if not any(True for _ in p.iter(_W + "txbxContent")))
+                elif tag == _MC + "AlternateContent":
+                    fallback = child.find(_MC + "Fallback")
+                    if fallback is not None:
+                        read_runs(fallback, pieces, images, state)
+                elif tag in (_WP + "inline", _WP + "anchor"):
+                    blip = next(child.iter(_A + "blip"), None)
+                    url = image_url(blip.get(_R + "embed")) if blip is not None else None
+                    if url:
+                        images.append(url)
+                elif tag == _V + "imagedata":
+                    url = image_url(child.get(_R + "id"))
+                    if url:
+                        images.append(url)
+                elif tag in _OOXML_CONTAINERS:
+                    read_runs(child, pieces, images, state)
+
+        def read_paragraph(p):
+            props = p.find(_W + "pPr")
+            style_id = None
+            numbered = False
+            if props is not None:
+                pstyle = props.find(_W + "pStyle")
+                style_id = pstyle.get(_W + "val") if pstyle is not None else None
+                num = props.find(_W + "numPr")
+                if num is not None:
+                    num_id, ilvl = num.find(_W + "numId"), num.find(_W + "ilvl")
+                    numbered = num_id is not None and ilvl is not None and num_id.get(_W + "val") in num_ids
+            pieces, images, state = [], [], {"anchor": False, "nested": []}
+            read_runs(p, pieces, images, state)
+            level = heading_styles.get(style_id)
+            if level:
+                kind = "heading"
+            elif numbered or style_id in list_styles:
+                kind = "list"
+            else:
+                kind = "p"
+            return {"kind": kind, "level": level, "pieces": pieces, "images": images, "anchor": state["anchor"],
+                    "nested": state["nested"]}
+
+        def target():
+            return stack[-1]["content"] if stack else None
+
+        def emit(para):
+            """Apply one paragraph the way the HTML walk would see its p/h/li element."""
+            pieces = para["pieces"]
+            if para["kind"] == "heading":
+                title = "".join(x for x in pieces if x is not None).strip()
+                has_content = title or para["images"] or para["anchor"]
+                if para["level"] <= 4 and has_content and not excluded(title):
+                    attach_heading(sections, stack, title, para["level"])
+            elif para["kind"] == "p":
+                text = "".join("\n" if x is None else x for x in pieces).strip()
+                if text and stack:
+                    target().append({"type": "text", "value": text})
+            if stack:
+                target().extend({"type": "image", "value": src} for src in para["images"])
+            for nested in para["nested"]:
+                emit(nested)
+
+        def paragraph_text(para):
+            texts = ["".join("\n" if x is None else x for x in para["pieces"]).strip()]
+            texts.extend(paragraph_text(nested) for nested in para["nested"])
+            return "\n".join(t for t in texts if t)
+
+        table_depth = 0
+        p_depth = 0
+        rows = deferred = row = cell = None
+        merged_columns: set = set()
+        column = 0
+
+        with zf.open("word/document.xml") as fh:
+            events = etree.iterparse(fh, events=("start", "end")) if LXML_AVAILABLE else ET.iterparse(fh, events=("start", "end"))
+            for event, el in events:
+                tag = el.tag
+                if event == "start":
+                    if tag == _W + "p":
+                        p_depth += 1
+                    elif tag == _W + "tbl" and p_depth == 0:
+                        table_depth += 1
+                        if table_depth == 1:
+                            rows, deferred, merged_columns = [], [], set()
+                    elif tag == _W + "tr" and table_depth == 1:
+                        row, column = [], 0
+                    elif tag == _W + "tc" and table_depth == 1:
+                        cell = {"paras": [], "skip": False, "span": 1}
+                    continue
+
+                if tag == _W + "p":
+                    p_depth -= 1
+                    if p_depth == 0:
+                        para = read_paragraph(el)
+                        if table_depth and cell is not None:
+                            cell["paras"].append(para)
+                        elif not table_depth:
+                            emit(para)
+                        el.clear()
+                elif tag == _W + "tcPr" and table_depth == 1 and cell is not None:
+                    span = el.find(_W + "gridSpan")
+                    cell["span"] = int(span.get(_W + "val", "1")) if span is not None else 1
+                    vmerge = el.find(_W + "vMerge")
+                    continued = vmerge is not None and vmerge.get(_W + "val") in (None, "continue")
+                    cell["skip"] = continued and column in merged_columns
+                elif tag == _W + "tc" and table_depth == 1 and cell is not None:
+                    if not cell["skip"]:
+                        merged_columns.add(column)
+                        texts = [paragraph_text(para) for para in cell["paras"]]
+                        row.append("\n".join(t for t in texts if t).strip())
+                        deferred.extend(cell["paras"])
+                    column += cell["span"]
+                    cell = None
+                elif tag == _W + "tr" and table_depth == 1:
+                    if row is not None:
+                        rows.append(row)
+                    row = None
+                elif tag == _W + "tbl" and p_depth == 0:
+                    table_depth -= 1
+                    if table_depth == 0:
+                        if rows and stack:
+                            target().append({"type": "table", "value": rows})
+                        for para in deferred:
+                            emit(para)
+                        rows = deferred = None
+                        el.clear()
+
+        if footnote_refs and "word/footnotes.xml" in zf.namelist():
+            notes = {note.get(_W + "id"): note for note in ET.fromstring(zf.read("word/footnotes.xml")).iter(_W + "footnote")}
+            for note_id in footnote_refs:
+                paras = [read_paragraph(p) for p in notes[note_id].findall(_W + "p")] if note_id in notes else []
+                if paras:
+                    paras[-1]["pieces"].append(" \u2191")
+                for para in paras:
+                    para["kind"] = "p"
+                    emit(para)
+    return sections
+
+ACTION_TABLE_HEADERS = ["Reference", "Step", "Description", "Ownership/Responsibility"]
+HEADER_KEYWORDS = ["reference", "step", "description", "ownership", "responsibility"]
+OWNER_KEYWORDS = ["incident response team", "irt", "ownership", "responsibility", "it team leadership", "risk management team", "grc"]
+# No header keyword overlaps another, so distinct alternation matches == keywords present.
+_header_re = re.compile("|".join(map(re.escape, HEADER_KEYWORDS)))
+_owner_re = re.compile("|".join(map(re.escape, OWNER_KEYWORDS)))
+
+def _is_header_like(txt_lower: str) -> bool:
+    seen = set()
+    for match in _header_re.finditer(txt_lower):
+        seen.add(match.group(0))
+        if len(seen) >= 2:
+            return True
+    return False
+
+def _action_row(ref: str, step: str, desc_parts: List[str]) -> List[str]:
+    desc = " ".join(desc_parts)
+    owner = desc_parts[-1] if desc_parts and _owner_re.search(desc_parts[-1].lower()) else ""
+    return [ref, step, desc, owner]
+
+def reconstruct_tables_in_section(section: Dict[str, Any]):
+    """Turn runs of "1.2 Step ..." paragraphs (optionally after a header line) into action tables, in one pass."""
+    contents = section.get("content", [])
+    n = len(contents)
+    i = 0
+    new_contents = []
+    while i < n:
+        item = contents[i]
+        if item["type"] != "text":
+            new_contents.append(item)
+            i += 1
+            continue
+        txt = item["value"].strip()
+        is_header_like = _is_header_like(txt.lower())
+        if not is_header_like and not ref_pattern.match(txt):
+            new_contents.append(item)
+            i += 1
+            continue
+        rows = []
+        current_ref = current_step = ""
+        current_desc_parts = []
+        j = i + 1 if is_header_like else i
+        while j < n and contents[j]["type"] == "text":
+            txt_j = contents[j]["value"].strip()
+            match_obj = ref_pattern.match(txt_j)
+            if match_obj:
+                if current_ref:
+                    rows.append(_action_row(current_ref, current_step, current_desc_parts))
+                    current_desc_parts = []
+                current_ref = match_obj.group(0)
+                current_step = txt_j[match_obj.end():].strip()
+            else:
+                current_desc_parts.append(txt_j)
+            j += 1
+        if current_ref:
+            rows.append(_action_row(current_ref, current_step, current_desc_parts))
+        if rows:
+            new_contents.append({"type": "table", "value": [list(ACTION_TABLE_HEADERS)] + rows})
+        i = j
+    section["content"] = new_contents
+
+def parse_playbook(path: str, mode: str = None, timings: Dict[str, float] = None) -> List[Dict[str, Any]]:
+    """Parse a .docx into sections. If `timings` is given, seconds per stage are recorded in it."""
+    timings = {} if timings is None else timings
+    mark = time.perf_counter()
+
+    def lap(stage):
+        nonlocal mark
+        now = time.perf_counter()
+        timings[stage] = timings.get(stage, 0.0) + now - mark
+        mark = now
+
+    if (mode or PARSER_MODE) == "ooxml":
+        sections = build_sections_ooxml(path)
+        lap("read_ooxml")
+    else:
+        with open(path, "rb") as fh:
+            result = mammoth.convert_to_html(fh, convert_image=mammoth.images.img_element(store_image_asset))
+            html = result.value
+        lap("mammoth")
+        sections = build_sections(html)
+        lap("build_sections")
+
+    def walk_and_reconstruct(nodes):
+        for n in nodes:
+            reconstruct_tables_in_section(n)
+            if n.get("subs"):
+                walk_and_reconstruct(n["subs"])
+
+    walk_and_reconstruct(sections)
+    lap("reconstruct_tables")
+
+    def prune(node):
+        kept_subs = [sub for sub in node.get("subs", []) if prune(sub)]
+        node["subs"] = kept_subs
+        return bool(node.get("content")) or bool(kept_subs)
+
+    sections = [s for s in sections if prune(s)]
+    lap("prune")
+    return sections
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--prewarm"]:
+        # python playbook_parser.py --prewarm PATH...: fill the parse cache, one JSON summary per line.
+        for path in sys.argv[2:]:
+            print(json.dumps(prewarm(path)), flush=True)
+        sys.exit(0)
+    # python playbook_parser.py [playbooks_dir]: check the streaming builder against BeautifulSoup.
+    playbooks_dir = sys.argv[1] if len(sys.argv) > 1 else "playbooks"
+    paths = sorted(os.path.join(playbooks_dir, f) for f in os.listdir(playbooks_dir) if f.lower().endswith(".docx"))
+    results = verify_section_builder(paths)
+    for name, same in results.items():
+        print(f"{'OK  ' if same else 'DIFF'} {name}")
+    sys.exit(0 if all(results.values()) else 1)
@@ -0,0 +1,143 @@
+# playbook_registry.py
+"""Process-wide registry of parsed playbooks and the start-up pre-warmer that fills it."""
+import os
+import sys
+import json
+import logging
+import threading
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from typing import Any, Dict, List
+
+import playbook_parser
+from playbook_parser import file_digest, load_or_parse
+from progress_store import TaskIndex
+from perf_spans import span
+
+def deep_sizeof(obj) -> int:
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k) + deep_sizeof(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(deep_sizeof(v) for v in obj)
+    return size
+
+class PlaybookRegistry:
+    """Parsed sections and TaskIndex per .docx digest, shared read-only by every session, LRU-evicted past max_bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+
+    def get(self, path: str) -> List[Dict[str, Any]]:
+        return self._entry(path)[0]
+
+    def task_index(self, path: str) -> "TaskIndex":
+        return self._entry(path)[1]
+
+    def _entry(self, path: str) -> tuple:
+        digest = file_digest(path)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry:
+                self._entries.move_to_end(digest)
+                self.hits += 1
+                return entry
+            key_lock = self._key_locks.setdefault(digest, threading.Lock())
+        # Parse outside the registry lock so other playbooks stay available,
+        # but only once per digest however many sessions ask for it.
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(digest)
+                if entry:
+                    self.hits += 1
+                    return entry
+            name = os.path.basename(path)
+            try:
+                with span("parse"):
+                    sections = load_or_parse(path, digest)
+                tasks = TaskIndex(name, sections)
+                size = deep_sizeof(sections) + deep_sizeof(tasks.tasks)
+                entry = (sections, tasks, size, name)
+                with self._lock:
+                    self.misses += 1
+                    self._entries[digest] = entry
+                    self.bytes_used += size
+                    while self.bytes_used > self.max_bytes and len(self._entries) > 1:
+                        _, (_, _, old_size, _) = self._entries.popitem(last=False)
+                        self.bytes_used -= old_size
+            finally:
+                # Also on a failed parse (corrupt upload), or the lock would live as long as the process.
+                with self._lock:
+                    self._key_locks.pop(digest, None)
+        return entry
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": [{"playbook": name, "digest": d, "bytes": size} for d, (_, _, size, name) in self._entries.items()],
+                "bytes_used": self.bytes_used,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+def prewarm_in_subprocess(path: str) -> Dict[str, Any]:
+    """playbook_parser.prewarm(path) in a fresh interpreter.
+
+    Not multiprocessing: under Streamlit the app script is __main__, and spawned
+    workers would re-run all of it before reaching the parser.
+    """
+    script = os.path.abspath(playbook_parser.__file__)
+    proc = subprocess.run([sys.executable, script, "--prewarm", path], capture_output=True, text=True)
+    if proc.returncode != 0:
+        lines = proc.stderr.strip().splitlines()
+        raise RuntimeError(lines[-1] if lines else f"exit status {proc.returncode}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+class PlaybookPrewarmer:
+    """Parses every playbook into the on-disk cache in worker processes on a daemon thread, then loads the registry."""
+
+    def __init__(self, registry: PlaybookRegistry, paths: List[str], workers: int):
+        self.registry = registry
+        self.paths = paths
+        self.workers = workers
+        self.done = 0
+        self.errors: Dict[str, str] = {}
+        self.finished = False
+        self._futures: Dict[str, Any] = {}
+        self._thread = threading.Thread(target=self._run, name="playbook-prewarm", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            # Each thread waits on one parser process, so `workers` playbooks parse at a time.
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="prewarm") as pool:
+                self._futures = {path: pool.submit(prewarm_in_subprocess, path) for path in self.paths}
+                for fut in as_completed(self._futures.values()):
+                    path = next(p for p, f in self._futures.items() if f is fut)
+                    try:
+                        result = fut.result()
+                        self.registry.get(path)
+                        stages = ", ".join(f"{k} {v:.3f}s" for k, v in result["stages"].items())
+                        logging.info(f"Pre-warmed {os.path.basename(path)} in {result['seconds']:.2f}s"
+                                     f"{f' ({stages})' if stages else ' (cached)'}")
+                    except Exception as e:
+                        self.errors[os.path.basename(path)] = str(e)
+                        logging.warning(f"Pre-warm failed for {path}: {e}")
+                    self.done += 1
+        except Exception as e:
+            logging.warning(f"Playbook pre-warm aborted: {e}")
+        finally:
+            self.finished = True
+
+    def wait_for(self, path: str, timeout: float = None):
+        fut = self._futures.get(path)
+        if fut is not None and not fut.done():
+            wait([fut], timeout=timeout)
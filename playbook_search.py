@@ -0,0 +1,192 @@
+# playbook_search.py
+"""Ranked full-text search across every playbook.
+
+Each playbook contributes a shard: one document per section title, paragraph and
+table row, hashed into term counts with scikit-learn's HashingVectorizer. Shards
+are stored next to the parse cache under the .docx digest, so a changed file only
+re-indexes itself; IDF weights are recomputed over all shards whenever the set
+changes, which is cheap compared with re-vectorising.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, List, Dict, Any
+
+from playbook_parser import CACHE_DIR, PARSER_MODE, PARSER_VERSION, file_digest
+
+try:
+    import numpy as np
+    from scipy import sparse
+    from sklearn.feature_extraction.text import HashingVectorizer
+    from sklearn.preprocessing import normalize
+    SEARCH_AVAILABLE = True
+except ImportError:
+    SEARCH_AVAILABLE = False
+
+SEARCH_CACHE_DIR = os.path.join(CACHE_DIR, "search")
+# Bump when section_documents or the vectorizer settings change.
+SEARCH_INDEX_VERSION = "1"
+SNIPPET_CHARS = 220
+Path(SEARCH_CACHE_DIR).mkdir(parents=True, exist_ok=True)
+
+def _vectorizer():
+    return HashingVectorizer(
+        n_features=2 ** 20,
+        ngram_range=(1, 2),
+        stop_words="english",
+        alternate_sign=False,
+        norm=None,
+    )
+
+def section_documents(sections: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Searchable units of a parsed playbook: section titles, paragraphs and table rows."""
+    docs = []
+
+    def walk(nodes, top):
+        for sec in nodes:
+            top_ref = top or [sec["title"], sec["level"]]
+            ref = {"section": [sec["title"], sec["level"]], "top": top_ref}
+            # Reconstructed tables repeat their source paragraphs; index each text once per section.
+            seen = set()
+
+            def add(kind, text):
+                norm = " ".join(text.replace(" | ", " ").split()).lower()
+                if norm and norm not in seen:
+                    seen.add(norm)
+                    docs.append(dict(ref, kind=kind, text=text))
+
+            add("section", sec["title"])
+            for item in sec.get("content", []):
+                if item["type"] == "text":
+                    add("text", item["value"])
+                elif item["type"] == "table":
+                    rows = item["value"]
+                    for row in rows[1:] if len(rows) > 1 else rows:
+                        add("row", " | ".join(cell for cell in row if cell))
+            walk(sec.get("subs", []), top_ref)
+
+    walk(sections, None)
+    return docs
+
+def _shard_base(digest: str) -> str:
+    return os.path.join(SEARCH_CACHE_DIR, f"{digest}_{PARSER_MODE}_v{PARSER_VERSION}_s{SEARCH_INDEX_VERSION}")
+
+def _load_shard(digest: str):
+    base = _shard_base(digest)
+    try:
+        with open(base + ".json", "r", encoding="utf-8") as fh:
+            docs = json.load(fh)
+        counts = sparse.load_npz(base + ".npz")
+    except (OSError, ValueError):
+        return None
+    return docs, counts
+
+def _store_shard(digest: str, docs: List[Dict[str, Any]], counts):
+    base = _shard_base(digest)
+    tmp = f".{os.getpid()}.tmp"
+    try:
+        with open(base + ".npz" + tmp, "wb") as fh:
+            sparse.save_npz(fh, counts)
+        with open(base + ".json" + tmp, "w", encoding="utf-8") as fh:
+            json.dump(docs, fh)
+        os.replace(base + ".npz" + tmp, base + ".npz")
+        os.replace(base + ".json" + tmp, base + ".json")
+    except OSError as e:
+        logging.warning(f"Could not write search shard for {digest}: {e}")
+
+def _drop_shard(digest: str):
+    base = _shard_base(digest)
+    for ext in (".npz", ".json"):
+        try:
+            os.remove(base + ext)
+        except OSError:
+            pass
+
+class SearchIndex:
+    """TF-IDF index over all playbooks, refreshed shard by shard as .docx files change."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._vectorizer = _vectorizer()
+        self._shards: Dict[str, tuple] = {}
+        self._docs: List[tuple] = []
+        self._matrix = None
+        self._idf = None
+
+    def refresh(self, paths: List[str], load_sections: Callable[[str], List[Dict[str, Any]]]) -> bool:
+        """Bring shards in line with `paths`; returns True if anything changed."""
+        changed = False
+        wanted = {os.path.basename(p): p for p in paths}
+        with self._lock:
+            for name in list(self._shards):
+                if name not in wanted:
+                    _drop_shard(self._shards.pop(name)[0])
+                    changed = True
+            for name, path in wanted.items():
+                digest = file_digest(path)
+                if name in self._shards:
+                    if self._shards[name][0] == digest:
+                        continue
+                    _drop_shard(self._shards[name][0])
+                shard = _load_shard(digest)
+                if shard is None:
+                    docs = section_documents(load_sections(path))
+                    counts = self._vectorizer.transform([d["text"] for d in docs]).tocsr()
+                    _store_shard(digest, docs, counts)
+                    shard = (docs, counts)
+                self._shards[name] = (digest,) + shard
+                changed = True
+            if changed:
+                self._rebuild()
+        return changed
+
+    def _rebuild(self):
+        names = sorted(self._shards)
+        self._docs = [(name, doc) for name in names for doc in self._shards[name][1]]
+        if not self._docs:
+            self._matrix = self._idf = None
+            return
+        counts = sparse.vstack([self._shards[name][2] for name in names]).tocsr()
+        n_docs = counts.shape[0]
+        df = np.bincount(counts.indices, minlength=counts.shape[1])
+        self._idf = np.log((1 + n_docs) / (1 + df)) + 1.0
+        self._matrix = normalize(counts.multiply(self._idf).tocsr())
+
+    def search(self, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+        query = (query or "").strip()
+        with self._lock:
+            if not query or self._matrix is None:
+                return []
+            q = normalize(self._vectorizer.transform([query]).multiply(self._idf).tocsr())
+            if q.nnz == 0:
+                return []
+            scores = (self._matrix @ q.T).toarray().ravel()
+            hits = np.flatnonzero(scores)
+            if hits.size > limit:
+                hits = hits[np.argpartition(-scores[hits], limit - 1)[:limit]]
+            hits = hits[np.argsort(-scores[hits], kind="stable")]
+            results = []
+            for i in hits:
+                playbook, doc = self._docs[i]
+                text = doc["text"]
+                results.append({
+                    "playbook": playbook,
+                    "score": float(scores[i]),
+                    "kind": doc["kind"],
+                    "section": doc["section"],
+                    "top": doc["top"],
+                    "snippet": text if len(text) <= SNIPPET_CHARS else text[:SNIPPET_CHARS].rstrip() + "…",
+                })
+            return results
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"playbooks": len(self._shards), "documents": len(self._docs)}
+
+def timed_search(index: SearchIndex, query: str, limit: int = 20):
+    start = time.perf_counter()
+    results = index.search(query, limit)
+    return results, (time.perf_counter() - start) * 1000
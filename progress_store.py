@@ -0,0 +1,425 @@
+# progress_store.py
+"""Task progress: the SQLite store, its shared cache, the per-session writer and the task index."""
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from playbook_parser import ref_pattern
+
+def stable_key(playbook_name: str, title: str, level: int) -> str:
+    base = f"{playbook_name}||{level}||{title}"
+    return "sec_" + hashlib.md5(base.encode("utf-8")).hexdigest()
+
+ACTION_HEADERS = {"reference","ref","step","description","ownership","responsibility","owner","responsible"}
+
+def is_action_table(rows: List[List[str]]) -> bool:
+    if not rows:
+        return False
+    headers = [h.strip().lower() for h in rows[0]]
+    hits = sum(1 for h in headers if any(k in h for k in ACTION_HEADERS))
+    return hits >= 2 or (len(rows[0]) >= 4 and ref_pattern.match(rows[0][0].strip()))
+
+def action_table_rows(rows: List[List[str]]) -> List[List[str]]:
+    """Task rows of an action table, padded to four columns."""
+    # Rows belong to the shared parsed playbook, so pad copies rather than the originals.
+    return [row + [""] * (4 - len(row)) for row in (rows[1:] if len(rows) > 1 else rows)]
+
+class TaskIndex:
+    """Action-table rows of a parsed playbook with integer ids; keys[id] is the stored key, ids[key] maps back."""
+
+    def __init__(self, playbook_name: str, sections: List[Dict[str, Any]]):
+        self.tasks: List[Dict[str, Any]] = []
+        self.by_key: Dict[str, Dict[str, Any]] = {}
+        self.keys: List[str] = []
+        self.ids: Dict[str, int] = {}
+        self.tables: Dict[tuple, List[Dict[str, Any]]] = {}
+        self.section_keys: Dict[str, List[str]] = {}
+        self.section_masks: Dict[str, int] = {}
+        self.section_titles: Dict[str, str] = {}
+        self.section_paths: Dict[str, tuple] = {}
+        for sec in sections:
+            top_key = stable_key(playbook_name, sec["title"], sec["level"])
+            self.section_keys.setdefault(top_key, [])
+            self.section_masks.setdefault(top_key, 0)
+            self._collect(playbook_name, sec, top_key, ())
+
+    def _collect(self, playbook_name: str, section: Dict[str, Any], top_key: str, parent_path: tuple):
+        sec_key = stable_key(playbook_name, section["title"], section["level"])
+        path = parent_path + (section["title"],)
+        self.section_titles[sec_key] = section["title"]
+        self.section_paths.setdefault(sec_key, path)
+        table_idx = 0
+        for item in section.get("content", []):
+            rows = item.get("value", []) if item.get("type") == "table" else None
+            if not rows or not is_action_table(rows):
+                continue
+            table = self.tables.setdefault((sec_key, table_idx), [])
+            for ridx, row in enumerate(action_table_rows(rows)):
+                key = f"{sec_key}::tbl::{table_idx}::row::{ridx}"
+                task = self.by_key.get(key)
+                if task is None:
+                    task_id = len(self.keys)
+                    task = {
+                        "id": task_id,
+                        "key": key,
+                        "comment_key": f"{key}::comment",
+                        "cb_key": f"cb_{playbook_name}_{task_id}",
+                        "ci_key": f"ci_{playbook_name}_{task_id}",
+                        "top": top_key,
+                        "sec_key": sec_key,
+                        "section": section["title"],
+                        "path": path,
+                        "ref": row[0],
+                        "step": row[1],
+                        "description": " ".join(row[2:-1]),
+                        "owner": row[-1],
+                    }
+                    self.keys.append(key)
+                    self.ids[key] = task_id
+                    self.by_key[key] = task
+                    self.section_keys[top_key].append(key)
+                    self.section_masks[top_key] |= 1 << task_id
+                self.tasks.append(task)
+                if len(table) == ridx:
+                    table.append(task)
+            table_idx += 1
+        for sub in section.get("subs", []):
+            self._collect(playbook_name, sub, top_key, path)
+
+class TaskProgress:
+    """Completion over a TaskIndex as a bitset (bit i is task id i); counts are popcounts."""
+
+    def __init__(self, index: TaskIndex, completed: Dict[str, bool]):
+        self.index = index
+        self.bits = sum(1 << index.ids[key] for key, value in completed.items() if value and key in index.ids)
+
+    def copy(self) -> "TaskProgress":
+        other = TaskProgress.__new__(TaskProgress)
+        other.index = self.index
+        other.bits = self.bits
+        return other
+
+    def is_done(self, task_id: int) -> bool:
+        return bool(self.bits >> task_id & 1)
+
+    def set(self, key: str, value: bool):
+        task_id = self.index.ids.get(key)
+        if task_id is None:
+            return
+        if value:
+            self.bits |= 1 << task_id
+        else:
+            self.bits &= ~(1 << task_id)
+
+    @property
+    def done(self) -> int:
+        return self.bits.bit_count()
+
+    @property
+    def total(self) -> int:
+        return len(self.index.keys)
+
+    @property
+    def pct(self) -> int:
+        return int(self.done / self.total * 100) if self.total else 0
+
+    def section(self, sec_key: str):
+        mask = self.index.section_masks.get(sec_key, 0)
+        return (self.bits & mask).bit_count(), len(self.index.section_keys.get(sec_key, ()))
+
+PROGRESS_KINDS = ("completed", "comments", "expanders")
+
+class ProgressStore:
+    """WAL-mode SQLite, one row per (playbook, kind, key); legacy <playbook>_progress.json files are imported on first load."""
+
+    def __init__(self, path: str, legacy_dir: str):
+        self.path = path
+        self.legacy_dir = legacy_dir
+        self._lock = threading.Lock()
+        self._migrated = set()
+        self._conn = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS progress (
+                playbook TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (playbook, kind, key)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS json_migrations (
+                playbook TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                migrated_at TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS generations (
+                playbook TEXT PRIMARY KEY,
+                generation INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS user_expanders (
+                user TEXT NOT NULL,
+                playbook TEXT NOT NULL,
+                key TEXT NOT NULL,
+                expanded INTEGER NOT NULL,
+                PRIMARY KEY (user, playbook, key)
+            ) WITHOUT ROWID;
+        """)
+
+    def _bump_generation(self, playbook_name: str) -> int:
+        self._conn.execute(
+            "INSERT INTO generations VALUES (?, 1) "
+            "ON CONFLICT (playbook) DO UPDATE SET generation = generation + 1",
+            (playbook_name,),
+        )
+        return self._conn.execute("SELECT generation FROM generations WHERE playbook = ?", (playbook_name,)).fetchone()[0]
+
+    def generation(self, playbook_name: str) -> int:
+        """Incremented by every committed write for the playbook, from any process."""
+        with self._lock:
+            self._migrate_json(playbook_name)
+            row = self._conn.execute("SELECT generation FROM generations WHERE playbook = ?", (playbook_name,)).fetchone()
+        return row[0] if row else 0
+
+    def _migrate_json(self, playbook_name: str):
+        if playbook_name in self._migrated:
+            return
+        done = self._conn.execute("SELECT 1 FROM json_migrations WHERE playbook = ?", (playbook_name,)).fetchone()
+        path = os.path.join(self.legacy_dir, f"{os.path.splitext(playbook_name)[0]}_progress.json")
+        if not done and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as fh:
+                    data = json.load(fh)
+            except (OSError, json.JSONDecodeError, ValueError) as e:
+                logging.warning(f"Skipping progress migration for {playbook_name}: {e}")
+                data = {}
+            stamp = data.get("timestamp") or datetime.now().isoformat()
+            rows = [
+                (playbook_name, kind, key, json.dumps(value), stamp)
+                for kind in PROGRESS_KINDS
+                for key, value in data.get(kind, {}).items()
+            ]
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Rows already in the database are newer than the JSON file.
+                self._conn.executemany("INSERT OR IGNORE INTO progress VALUES (?, ?, ?, ?, ?)", rows)
+                self._conn.execute("INSERT OR REPLACE INTO json_migrations VALUES (?, ?, ?)",
+                                   (playbook_name, path, datetime.now().isoformat()))
+                self._bump_generation(playbook_name)
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                self._conn.execute("ROLLBACK")
+                raise
+            logging.info(f"Migrated {len(rows)} progress rows for {playbook_name} from {path}")
+        self._migrated.add(playbook_name)
+
+    def load(self, playbook_name: str):
+        maps = {kind: {} for kind in PROGRESS_KINDS}
+        with self._lock:
+            self._migrate_json(playbook_name)
+            cur = self._conn.execute("SELECT kind, key, value FROM progress WHERE playbook = ?", (playbook_name,))
+            for kind, key, value in cur:
+                if kind in maps:
+                    maps[kind][key] = json.loads(value)
+        return maps["completed"], maps["comments"], maps["expanders"]
+
+    def iter_tasks(self, playbook_name: str):
+        """Yield (key, completed, comment, updated_at) per task or section; row comments are folded onto their row."""
+        # Own connection, so a long export never holds the writer lock.
+        with self._lock:
+            self._migrate_json(playbook_name)
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            cur = conn.execute("""
+                SELECT CASE WHEN kind = 'comments' AND key LIKE '%::comment'
+                            THEN substr(key, 1, length(key) - 9) ELSE key END AS task_key,
+                       MAX(CASE WHEN kind = 'completed' THEN value END),
+                       MAX(CASE WHEN kind = 'comments' THEN value END),
+                       MAX(updated_at)
+                FROM progress
+                WHERE playbook = ? AND kind IN ('completed', 'comments')
+                GROUP BY task_key
+                ORDER BY task_key
+            """, (playbook_name,))
+            for key, completed, comment, updated_at in cur:
+                yield key, json.loads(completed) if completed else None, json.loads(comment) if comment else "", updated_at
+        finally:
+            conn.close()
+
+    def upsert(self, playbook_name: str, completed: dict, comments: dict, expanders: dict) -> int:
+        """Write the given entries in one transaction and return the playbook's new generation."""
+        stamp = datetime.now().isoformat()
+        rows = [
+            (playbook_name, kind, key, json.dumps(value), stamp)
+            for kind, changes in zip(PROGRESS_KINDS, (completed, comments, expanders))
+            for key, value in changes.items()
+        ]
+        if not rows:
+            return self.generation(playbook_name)
+        with self._lock:
+            self._migrate_json(playbook_name)
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO progress VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (playbook, kind, key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+                    rows,
+                )
+                generation = self._bump_generation(playbook_name)
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                self._conn.execute("ROLLBACK")
+                raise
+        return generation
+
+    def remap(self, playbook_name: str, moves: Dict[str, str]) -> int:
+        """Rename keys (old -> new) in progress and per-user expander rows; returns the rows moved."""
+        # All moved rows are deleted before any is re-inserted, so swaps are safe.
+        moves = {old: new for old, new in moves.items() if old != new}
+        if not moves:
+            return 0
+        with self._lock:
+            self._migrate_json(playbook_name)
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                progress = [row for row in self._conn.execute(
+                    "SELECT kind, key, value, updated_at FROM progress WHERE playbook = ?", (playbook_name,))
+                    if row[1] in moves]
+                expanders = [row for row in self._conn.execute(
+                    "SELECT user, key, expanded FROM user_expanders WHERE playbook = ?", (playbook_name,))
+                    if row[1] in moves]
+                self._conn.executemany("DELETE FROM progress WHERE playbook = ? AND kind = ? AND key = ?",
+                                       [(playbook_name, kind, key) for kind, key, _, _ in progress])
+                self._conn.executemany("INSERT OR REPLACE INTO progress VALUES (?, ?, ?, ?, ?)",
+                                       [(playbook_name, kind, moves[key], value, stamp) for kind, key, value, stamp in progress])
+                self._conn.executemany("DELETE FROM user_expanders WHERE user = ? AND playbook = ? AND key = ?",
+                                       [(user, playbook_name, key) for user, key, _ in expanders])
+                self._conn.executemany("INSERT OR REPLACE INTO user_expanders VALUES (?, ?, ?, ?)",
+                                       [(user, playbook_name, moves[key], expanded) for user, key, expanded in expanders])
+                self._bump_generation(playbook_name)
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                self._conn.execute("ROLLBACK")
+                raise
+        return len(progress) + len(expanders)
+
+    def load_user_expanders(self, user: str, playbook_name: str) -> Dict[str, bool]:
+        with self._lock:
+            cur = self._conn.execute(
+                "SELECT key, expanded FROM user_expanders WHERE user = ? AND playbook = ?", (user, playbook_name))
+            return {key: bool(expanded) for key, expanded in cur}
+
+    def save_user_expanders(self, user: str, playbook_name: str, states: Dict[str, bool]):
+        """Per-user UI state; kept out of the progress rows so it never bumps their generation."""
+        if not states:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO user_expanders VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (user, playbook, key) DO UPDATE SET expanded = excluded.expanded",
+                    [(user, playbook_name, key, int(value)) for key, value in states.items()],
+                )
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                self._conn.execute("ROLLBACK")
+                raise
+
+class ProgressCache:
+    """Progress maps per playbook, reloaded only when the store's generation moves on."""
+
+    def __init__(self, store: ProgressStore):
+        self.store = store
+        self._lock = threading.Lock()
+        self._entries: Dict[str, tuple] = {}
+        self._counters: Dict[str, tuple] = {}
+
+    def _entry(self, playbook_name: str) -> tuple:
+        generation = self.store.generation(playbook_name)
+        with self._lock:
+            entry = self._entries.get(playbook_name)
+        if not entry or entry[0] != generation:
+            # Tagged with the generation read before loading, so a racing write only causes a later reload.
+            entry = (generation,) + self.store.load(playbook_name)
+            with self._lock:
+                self._entries[playbook_name] = entry
+        return entry
+
+    def load(self, playbook_name: str):
+        # Callers mutate what they get back, so hand out copies.
+        return tuple(dict(m) for m in self._entry(playbook_name)[1:])
+
+    def task_progress(self, playbook_name: str, index: "TaskIndex") -> "TaskProgress":
+        """Completion counters for a playbook's tasks; the copy returned is the caller's to update."""
+        entry = self._entry(playbook_name)
+        with self._lock:
+            counters = self._counters.get(playbook_name)
+            if not counters or counters[0] != entry[0] or counters[1].index is not index:
+                counters = (entry[0], TaskProgress(index, entry[1]))
+                self._counters[playbook_name] = counters
+            return counters[1].copy()
+
+    def write(self, playbook_name: str, completed: dict, comments: dict, expanders: dict) -> int:
+        generation = self.store.upsert(playbook_name, completed, comments, expanders)
+        with self._lock:
+            entry = self._entries.get(playbook_name)
+            if entry and entry[0] == generation - 1:
+                counters = self._counters.get(playbook_name)
+                if counters and counters[0] == entry[0]:
+                    for key, value in completed.items():
+                        counters[1].set(key, value)
+                    self._counters[playbook_name] = (generation, counters[1])
+                for cached, changes in zip(entry[1:], (completed, comments, expanders)):
+                    cached.update(changes)
+                self._entries[playbook_name] = (generation,) + entry[1:]
+            elif entry and entry[0] != generation:
+                del self._entries[playbook_name]
+        return generation
+
+class ProgressWriter:
+    """Per-session write-behind buffer: one save per dirty playbook per flush.
+
+    While `deferred` (auto-save off), task and comment changes wait for flush(force=True).
+    `on_write(playbook, kind, key, old, new)` is called for each key a flush persists,
+    with the value it had before the first unsaved edit.
+    """
+
+    def __init__(self, save: Callable[[str, dict, dict, dict], Any],
+                 on_write: Optional[Callable[[str, str, str, Any, Any], Any]] = None):
+        self.save = save
+        self.on_write = on_write
+        self.dirty: Dict[str, Dict[str, dict]] = {}
+        self.before: Dict[tuple, Any] = {}
+        self.deferred = False
+
+    def mark(self, playbook_name: str, kind: str, key: str, value, old=None):
+        self.dirty.setdefault(playbook_name, {k: {} for k in PROGRESS_KINDS})[kind][key] = value
+        self.before.setdefault((playbook_name, kind, key), old)
+
+    def pending(self, playbook_name: str) -> Dict[str, dict]:
+        return self.dirty.get(playbook_name, {k: {} for k in PROGRESS_KINDS})
+
+    def flush(self, force: bool = False) -> int:
+        kinds = PROGRESS_KINDS if force or not self.deferred else ("expanders",)
+        written = 0
+        for playbook_name, changes in list(self.dirty.items()):
+            batch = {k: changes[k] if k in kinds else {} for k in PROGRESS_KINDS}
+            if any(batch.values()):
+                self.save(playbook_name, batch["completed"], batch["comments"], batch["expanders"])
+                written += sum(len(m) for m in batch.values())
+            for kind in kinds:
+                for key, value in changes[kind].items():
+                    old = self.before.pop((playbook_name, kind, key), None)
+                    if self.on_write and old != value:
+                        self.on_write(playbook_name, kind, key, old, value)
+                changes[kind] = {}
+            if not any(changes.values()):
+                del self.dirty[playbook_name]
+        return written
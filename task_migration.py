@@ -0,0 +1,152 @@
+# task_migration.py
+"""Carry recorded progress over to a new version of a playbook.
+
+Task keys are positional: a hash of the section title plus table and row
+indices. Inserting a row, reordering a table or renaming a heading therefore
+gives tasks new keys and orphans their progress. plan_moves() diffs the task
+lists of the old and new parse by content instead:
+
+1. Tasks whose reference, step, description and section path are unchanged
+   match directly, as long as that content is unique on both sides.
+2. The rest are scored pairwise on reference number, step/description token
+   overlap and section path, and matched greedily from the best score down.
+3. Sections follow their tasks: an old section maps to the new section that
+   most of its matched tasks moved to. Sections without tasks fall back to
+   title similarity under the same parent path.
+
+The result is an old-key -> new-key map for tasks and one for sections, which
+the caller turns into key renames for the progress store.
+"""
+import re
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Tuple
+
+# Minimum score for a scored match; see _score for the weights.
+MATCH_THRESHOLD = 0.6
+# Candidates are looked up through each task's rarest words only, which keeps the pass near-linear.
+CANDIDATE_WORDS = 4
+SECTION_TITLE_THRESHOLD = 0.5
+
+_WORD = re.compile(r"\w+")
+
+def _norm(text: str) -> str:
+    return " ".join(_WORD.findall((text or "").lower()))
+
+def _tokens(text: str) -> frozenset:
+    return frozenset(_WORD.findall((text or "").lower()))
+
+def _overlap(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def _signature(task: Dict[str, Any]) -> tuple:
+    return (_norm(task["ref"]), _norm(task["step"]), _norm(task["description"]), tuple(task["path"]))
+
+def _score(a: Dict[str, Any], b: Dict[str, Any], a_words: frozenset, b_words: frozenset) -> float:
+    ref = 1.0 if a["ref"] and _norm(a["ref"]) == _norm(b["ref"]) else 0.0
+    text = _overlap(a_words, b_words)
+    path = 0.5 * (a["path"][0] == b["path"][0]) + 0.5 * (a["path"][-1] == b["path"][-1])
+    return 0.3 * ref + 0.55 * text + 0.15 * path
+
+def match_tasks(old: List[Dict[str, Any]], new: List[Dict[str, Any]]) -> Dict[str, str]:
+    """old task key -> new task key for every old task with a confident counterpart."""
+    matches: Dict[str, str] = {}
+
+    by_signature_old = defaultdict(list)
+    by_signature_new = defaultdict(list)
+    for task in old:
+        by_signature_old[_signature(task)].append(task)
+    for task in new:
+        by_signature_new[_signature(task)].append(task)
+    for signature, olds in by_signature_old.items():
+        news = by_signature_new.get(signature, [])
+        if len(olds) == 1 and len(news) == 1:
+            matches[olds[0]["key"]] = news[0]["key"]
+
+    taken = set(matches.values())
+    rest_old = [t for t in old if t["key"] not in matches]
+    rest_new = [t for t in new if t["key"] not in taken]
+    if not rest_old or not rest_new:
+        return matches
+
+    # Old and new tasks can share a key (that is the problem being solved), so keep their words apart.
+    old_words = {t["key"]: _tokens(f"{t['step']} {t['description']}") for t in rest_old}
+    new_words = {t["key"]: _tokens(f"{t['step']} {t['description']}") for t in rest_new}
+    # A pair needs a shared reference or shared words to clear the threshold; a real match
+    # shares its rare words, so common ones ("the", "incident") are not used for lookup.
+    by_ref, by_word = defaultdict(list), defaultdict(list)
+    for t in rest_new:
+        if t["ref"]:
+            by_ref[_norm(t["ref"])].append(t)
+        for word in new_words[t["key"]]:
+            by_word[word].append(t)
+    candidates = []
+    for a in rest_old:
+        seen = {}
+        for b in by_ref.get(_norm(a["ref"]), []) if a["ref"] else []:
+            seen[b["key"]] = b
+        rare = sorted(old_words[a["key"]], key=lambda w: (len(by_word.get(w, ())) or len(rest_new) + 1, w))
+        for word in rare[:CANDIDATE_WORDS]:
+            for b in by_word.get(word, []):
+                seen[b["key"]] = b
+        for b in seen.values():
+            score = _score(a, b, old_words[a["key"]], new_words[b["key"]])
+            if score >= MATCH_THRESHOLD:
+                candidates.append((score, a["key"], b["key"]))
+    # Highest score first; ties keep document order.
+    candidates.sort(key=lambda c: -c[0])
+    for _, a_key, b_key in candidates:
+        if a_key not in matches and b_key not in taken:
+            matches[a_key] = b_key
+            taken.add(b_key)
+    return matches
+
+def match_sections(old_sections: Dict[str, Tuple[str, ...]], new_sections: Dict[str, Tuple[str, ...]],
+                   old_tasks: List[Dict[str, Any]], new_tasks: List[Dict[str, Any]],
+                   task_matches: Dict[str, str]) -> Dict[str, str]:
+    """old section key -> new section key; sections are given as key -> title path."""
+    matches: Dict[str, str] = {key: key for key in old_sections if key in new_sections}
+
+    new_section_of = {t["key"]: t["sec_key"] for t in new_tasks}
+    votes: Dict[str, Counter] = defaultdict(Counter)
+    for t in old_tasks:
+        if t["sec_key"] not in matches and t["key"] in task_matches:
+            votes[t["sec_key"]][new_section_of[task_matches[t["key"]]]] += 1
+    taken = set(matches.values())
+    for old_key, counter in sorted(votes.items(), key=lambda kv: -sum(kv[1].values())):
+        for new_key, _ in counter.most_common():
+            if new_key not in taken:
+                matches[old_key] = new_key
+                taken.add(new_key)
+                break
+
+    # Task-less sections (or ones whose tasks all changed): similar title under the same parent.
+    candidates = []
+    for old_key, old_path in old_sections.items():
+        if old_key in matches:
+            continue
+        old_words = _tokens(old_path[-1])
+        for new_key, new_path in new_sections.items():
+            if new_key in taken or len(new_path) != len(old_path) or new_path[:-1] != old_path[:-1]:
+                continue
+            score = _overlap(old_words, _tokens(new_path[-1]))
+            if score >= SECTION_TITLE_THRESHOLD:
+                candidates.append((score, old_key, new_key))
+    candidates.sort(key=lambda c: -c[0])
+    for _, old_key, new_key in candidates:
+        if old_key not in matches and new_key not in taken:
+            matches[old_key] = new_key
+            taken.add(new_key)
+    return matches
+
+def plan_moves(old_index, new_index) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """(task matches, section matches) between two TaskIndex-like objects, unchanged keys included.
+
+    Each index needs `by_key` (key -> task with key, sec_key, path, ref, step,
+    description) and `section_paths` (section key -> tuple of titles from the top).
+    """
+    old_tasks, new_tasks = list(old_index.by_key.values()), list(new_index.by_key.values())
+    tasks = match_tasks(old_tasks, new_tasks)
+    sections = match_sections(old_index.section_paths, new_index.section_paths, old_tasks, new_tasks, tasks)
+    return tasks, sections
@@ -0,0 +1,92 @@
+# tests/test_task_migration.py
+"""plan_moves / match_tasks on small synthetic playbooks: insert, delete, rename, reorder."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from progress_store import TaskIndex  # noqa: E402
+from task_migration import match_tasks, plan_moves  # noqa: E402
+
+PLAYBOOK = "Test Playbook.docx"
+HEADER = ["Reference", "Step", "Description", "Owner"]
+ROWS = [
+    ["1.1", "Isolate", "Disconnect affected hosts from the network", "IT"],
+    ["1.2", "Preserve", "Capture memory and disk images for forensics", "Security"],
+    ["1.3", "Notify", "Inform the insurer and legal counsel", "Legal"],
+    ["1.4", "Restore", "Rebuild servers from known-good backups", "IT"],
+]
+
+def playbook(rows, title="Containment", other_title="Recovery"):
+    return [
+        {"title": title, "level": 1, "content": [{"type": "table", "value": [HEADER] + rows}], "subs": []},
+        {"title": other_title, "level": 1, "content": [{"type": "text", "value": "Lessons learned."}], "subs": []},
+    ]
+
+def index(rows, **titles):
+    return TaskIndex(PLAYBOOK, playbook(rows, **titles))
+
+def by_ref(idx):
+    return {t["ref"]: t["key"] for t in idx.by_key.values()}
+
+def assert_follows_content(old, new, tasks):
+    """Every old task whose reference is still present maps to the new task with that reference."""
+    old_refs, new_refs = by_ref(old), by_ref(new)
+    expected = {key: new_refs[ref] for ref, key in old_refs.items() if ref in new_refs}
+    assert tasks == expected
+
+def test_unchanged_maps_every_key_to_itself():
+    old, new = index(ROWS), index(ROWS)
+    tasks, sections = plan_moves(old, new)
+    assert tasks == {key: key for key in old.by_key}
+    assert sections == {key: key for key in old.section_paths}
+
+def test_insert_shifts_positional_keys_but_not_matches():
+    old = index(ROWS)
+    new = index([["1.0", "Triage", "Confirm the alert is a real ransomware event", "SOC"]] + ROWS)
+    tasks, _ = plan_moves(old, new)
+    assert_follows_content(old, new, tasks)
+    # The inserted row took the first task's old position, so its key did change.
+    assert tasks[by_ref(old)["1.1"]] != by_ref(old)["1.1"]
+
+def test_delete_leaves_the_removed_task_unmatched():
+    old = index(ROWS)
+    new = index(ROWS[:1] + ROWS[2:])
+    tasks, _ = plan_moves(old, new)
+    assert by_ref(old)["1.2"] not in tasks
+    assert_follows_content(old, new, tasks)
+    # The removed task's key now names the task after it.
+    assert by_ref(old)["1.2"] in new.by_key
+
+def test_reorder_follows_content():
+    old = index(ROWS)
+    new = index(list(reversed(ROWS)))
+    tasks, _ = plan_moves(old, new)
+    assert_follows_content(old, new, tasks)
+    assert sorted(tasks.values()) == sorted(new.by_key)
+
+def test_renamed_heading_moves_tasks_and_section():
+    old = index(ROWS)
+    new = index(ROWS, title="Containment and Isolation", other_title="Recovery Steps")
+    tasks, sections = plan_moves(old, new)
+    assert_follows_content(old, new, tasks)
+    assert all(old_key != new_key for old_key, new_key in tasks.items())
+    old_sections = {path[-1]: key for key, path in old.section_paths.items()}
+    new_sections = {path[-1]: key for key, path in new.section_paths.items()}
+    # The table's section follows its tasks; the task-less one is matched on title words.
+    assert sections[old_sections["Containment"]] == new_sections["Containment and Isolation"]
+    assert sections[old_sections["Recovery"]] == new_sections["Recovery Steps"]
+
+def test_edited_description_still_matches_by_score():
+    old = index(ROWS)
+    edited = [list(row) for row in ROWS]
+    edited[1][2] = "Capture memory and disk images for forensic analysis"
+    new = index(list(reversed(edited)))
+    tasks, _ = plan_moves(old, new)
+    assert_follows_content(old, new, tasks)
+
+def test_unrelated_task_is_not_matched():
+    old = index(ROWS)
+    new_task = {"key": "k", "sec_key": "s", "path": ("Other",), "ref": "9.9",
+                "step": "Celebrate", "description": "Order pizza for the responders"}
+    assert match_tasks(list(old.by_key.values()), [new_task]) == {}